@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""Asyncio counterparts of MongoInterface and helpers; requires pymongo>=4.9"""
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Union
+
+from pymongo import UpdateOne
+
+try:
+    from gridfs import AsyncGridFS
+    from pymongo import AsyncMongoClient
+    from pymongo.asynchronous.collection import AsyncCollection
+    from pymongo.asynchronous.command_cursor import AsyncCommandCursor
+    from pymongo.asynchronous.cursor import AsyncCursor
+    from pymongo.asynchronous.database import AsyncDatabase
+except ImportError as _exc:
+    raise ImportError("joker.mongodb.asynchronous requires pymongo>=4.9") from _exc
+
+from joker.mongodb.batch import (
+    BatchProgress,
+    _default_chunk_bytes,
+    encode_documents,
+    iter_chunks,
+)
+from joker.mongodb.legacy import MongoInterface
+from joker.mongodb.query import _namemap_to_project
+from joker.mongodb.tools.kvstore import MISSING, _Document
+from joker.mongodb.tools.pagination import (
+    CachedCounter,
+    PaginatedResult,
+    QueryParams,
+    TotalCounter,
+)
+
+_logger = logging.getLogger(__name__)
+
+
+class AsyncMongoInterface(MongoInterface):
+    """A interface for multiple mongodb clusters, with asyncio clients."""
+
+    @staticmethod
+    def _create_client(params: dict) -> AsyncMongoClient:
+        return AsyncMongoClient(**params)
+
+    def get_mongo(self, host: str = None) -> AsyncMongoClient:
+        return super().get_mongo(host)
+
+    @property
+    def db(self) -> AsyncDatabase:
+        return self.get_db(self.default_host, self.default_db_name)
+
+    def __call__(self, *names) -> AsyncCollection:
+        return super().__call__(*names)
+
+    def get_db(self, host: str, db_name: str) -> AsyncDatabase:
+        return super().get_db(host, db_name)
+
+    def get_coll(self, host: str, db_name: str, coll_name: str) -> AsyncCollection:
+        return super().get_coll(host, db_name, coll_name)
+
+    def get_gridfs(self, host: str, db_name: str, coll_name: str = "fs") -> AsyncGridFS:
+        assert not coll_name.endswith(".files")
+        assert not coll_name.endswith(".chunks")
+        db = self.get_db(host, db_name)
+        return AsyncGridFS(db, collection=coll_name)
+
+    async def _warm_up_host(self, host: str):
+        client = self.get_mongo(host)
+        count = max(1, client.options.pool_options.min_pool_size)
+        pings = [client.admin.command("ping") for _ in range(count)]
+        await asyncio.gather(*pings)
+
+    async def warm_up(self, hosts: list[str] = None):
+        if hosts is None:
+            hosts = list(self.hosts)
+        await asyncio.gather(*[self._warm_up_host(h) for h in hosts])
+
+    async def close(self):
+        for client in list(self._clients.values()):
+            await client.close()
+        self._clients.clear()
+
+
+# --- batch.py ---
+
+
+async def batch_insert(c: AsyncCollection, records: Iterable[dict]):
+    async with c.database.client.start_session() as session:
+        async with await session.start_transaction():
+            return await c.insert_many(records, session=session)
+
+
+async def batch_update(c: AsyncCollection, filtr: dict | list, props: dict):
+    if isinstance(filtr, list):
+        filtr = {"_id": {"$in": filtr}}
+    async with c.database.client.start_session() as session:
+        async with await session.start_transaction():
+            return await c.update_many(filtr, {"$set": props}, session=session)
+
+
+async def batch_delete(c: AsyncCollection, filtr: dict | list):
+    if isinstance(filtr, list):
+        filtr = {"_id": {"$in": filtr}}
+    async with c.database.client.start_session() as session:
+        async with await session.start_transaction():
+            return await c.delete_many(filtr, session=session)
+
+
+async def _aencode_documents(records: AsyncIterable[dict], codec_options):
+    async for rec in records:
+        for raw in encode_documents([rec], codec_options):
+            yield raw
+
+
+async def _aiter_chunks(
+    records: Union[Iterable[dict], AsyncIterable[dict]],
+    size: int,
+    max_bytes: int = None,
+) -> AsyncIterator[list[dict]]:
+    if not hasattr(records, "__aiter__"):
+        for chunk in iter_chunks(records, size, max_bytes):
+            yield chunk
+        return
+    chunk = []
+    async for rec in records:
+        chunk.append(rec)
+        if len(chunk) >= size:
+            for sub_chunk in iter_chunks(chunk, size, max_bytes):
+                yield sub_chunk
+            chunk = []
+    if chunk:
+        for sub_chunk in iter_chunks(chunk, size, max_bytes):
+            yield sub_chunk
+
+
+async def _insert_chunk(
+    c: AsyncCollection, chunk: list[dict], transaction: bool
+) -> int:
+    if not transaction:
+        ir = await c.insert_many(chunk, ordered=False)
+        return len(ir.inserted_ids)
+    async with c.database.client.start_session() as session:
+        async with await session.start_transaction():
+            ir = await c.insert_many(chunk, ordered=False, session=session)
+    return len(ir.inserted_ids)
+
+
+async def stream_insert(
+    c: AsyncCollection,
+    records: Union[Iterable[dict], AsyncIterable[dict]],
+    chunk_size: int = 1000,
+    chunk_bytes: int = _default_chunk_bytes,
+    transaction: bool = False,
+    callback: Callable[[BatchProgress], None] = None,
+) -> BatchProgress:
+    """See `joker.mongodb.batch.stream_insert`
+
+    `callback` may also be a coroutine function.
+    """
+    progress = BatchProgress()
+    if chunk_bytes and hasattr(records, "__aiter__"):
+        records = _aencode_documents(records, c.codec_options)
+    elif chunk_bytes:
+        records = encode_documents(records, c.codec_options)
+    async for chunk in _aiter_chunks(records, chunk_size, chunk_bytes):
+        progress.inserted += await _insert_chunk(c, chunk, transaction)
+        progress.chunks += 1
+        progress.last_chunk_size = len(chunk)
+        _logger.info(
+            "inserted chunk #%s into %s, %s records, %.1f records/s",
+            progress.chunks,
+            c.full_name,
+            len(chunk),
+            progress.throughput,
+        )
+        if callback is None:
+            continue
+        ret = callback(progress)
+        if inspect.isawaitable(ret):
+            await ret
+    return progress
+
+
+# --- query.py ---
+
+
+async def find_with_renaming(
+    coll: AsyncCollection, filtr: dict, namemap: dict, sort: dict = None
+) -> AsyncCommandCursor:
+    pipelines = [
+        {"$match": filtr},
+        {"$sort": sort or {"_id": -1}},
+        {"$project": _namemap_to_project(namemap)},
+    ]
+    return await coll.aggregate(pipelines)
+
+
+async def find_one_with_renaming(
+    coll: AsyncCollection, filtr: dict, namemap: dict, sort: dict = None
+):
+    pipelines = [
+        {"$match": filtr},
+        {"$sort": sort or {"_id": -1}},
+        {"$limit": 1},
+        {"$project": _namemap_to_project(namemap)},
+    ]
+    async for doc in await coll.aggregate(pipelines):
+        return doc
+
+
+def find_most_recent(c: AsyncCollection, **kwargs) -> AsyncCursor:
+    kwargs.setdefault("limit", 10)
+    kwargs.setdefault("sort", [("$natural", -1)])
+    return c.find(**kwargs)
+
+
+async def find_most_recent_one(c: AsyncCollection, **kwargs) -> dict:
+    kwargs.setdefault("sort", [("$natural", -1)])
+    return await c.find_one(**kwargs)
+
+
+async def find_unique(c: AsyncCollection, keys: list[str]) -> AsyncIterator[dict]:
+    pipeline = [{"$group": {"_id": {k: f"${k}" for k in keys}}}]
+    async for record in await c.aggregate(pipeline):
+        yield record["_id"]
+
+
+async def find_unique_tuples(
+    c: AsyncCollection, keys: list[str]
+) -> AsyncIterator[tuple]:
+    async for record in find_unique(c, keys):
+        yield tuple(record[k] for k in keys)
+
+
+# --- tools/kvstore.py ---
+
+
+async def kv_load(c: AsyncCollection, key: str) -> _Document:
+    record = await c.find_one(
+        {"_id": key},
+        projection={"_id": False, "value": True},
+    )
+    if record is None:
+        return
+    return record.get("value")
+
+
+async def kv_save(c: AsyncCollection, key: str, value: _Document):
+    return await c.update_one(
+        {"_id": key},
+        {"$set": {"value": value}},
+        upsert=True,
+    )
+
+
+async def kv_load_many(
+    c: AsyncCollection, keys: Iterable[str], missing=MISSING, chunk_size: int = 1000
+) -> dict[str, _Document]:
+    values = {}
+    for chunk in iter_chunks(keys, chunk_size):
+        values.update(dict.fromkeys(chunk, missing))
+        async for record in c.find({"_id": {"$in": chunk}}, {"value": True}):
+            values[record["_id"]] = record.get("value")
+    return values
+
+
+async def kv_save_many(
+    c: AsyncCollection, mapping: dict[str, _Document], chunk_size: int = 1000
+):
+    results = []
+    for chunk in iter_chunks(mapping.items(), chunk_size):
+        ops = [
+            UpdateOne({"_id": key}, {"$set": {"value": value}}, upsert=True)
+            for key, value in chunk
+        ]
+        results.append(await c.bulk_write(ops, ordered=False))
+    return results
+
+
+class AsyncKVStore:
+    def __init__(self, collection: AsyncCollection):
+        self._collection = collection
+
+    async def load(self, key: str) -> _Document:
+        return await kv_load(self._collection, key)
+
+    async def save(self, key: str, value: _Document):
+        return await kv_save(self._collection, key, value)
+
+    async def load_many(
+        self, keys: Iterable[str], missing=MISSING
+    ) -> dict[str, _Document]:
+        return await kv_load_many(self._collection, keys, missing)
+
+    async def save_many(self, mapping: dict[str, _Document]):
+        return await kv_save_many(self._collection, mapping)
+
+
+# --- tools/pagination.py ---
+
+
+async def _count_total(counter: TotalCounter, coll: AsyncCollection, filtr: dict):
+    # the stock counters return what the collection methods return,
+    # i.e. coroutines here; CachedCounter must not cache those
+    if isinstance(counter, CachedCounter):
+        key = counter._normalize(coll, filtr)
+        total = counter._get_cached(key)
+        if total is None:
+            total = await _count_total(counter.counter, coll, filtr)
+            counter._set_cached(key, total)
+        return total
+    total = counter.count(coll, filtr)
+    if inspect.isawaitable(total):
+        total = await total
+    return total
+
+
+async def paginate(
+    coll: AsyncCollection,
+    filtr: dict,
+    params: QueryParams,
+    counter: TotalCounter = None,
+) -> PaginatedResult:
+    """See `joker.mongodb.tools.pagination.paginate`"""
+    pipeline = [{"$match": filtr}]
+    pipeline.extend(params.get_pagination_pipeline(with_counts=counter is None))
+    cursor = await coll.aggregate(pipeline)
+    result = PaginatedResult.from_raw(await cursor.to_list())
+    if counter is not None:
+        result.total = await _count_total(counter, coll, filtr)
+    return result
+
+
+async def paginate_keyset(
+    coll: AsyncCollection, filtr: dict, params: QueryParams
+) -> PaginatedResult:
+    pipeline = [{"$match": filtr}]
+    pipeline.extend(params.get_keyset_pipeline())
+    cursor = await coll.aggregate(pipeline)
+    return PaginatedResult.from_keyset(await cursor.to_list(), params)
@@ -2,14 +2,23 @@
 # coding: utf-8
 from __future__ import annotations
 
+import dataclasses
 import logging
-from typing import Iterable
+import time
+from typing import Callable, Iterable, Iterator
 
+import bson
+from bson import ObjectId
+from bson.codec_options import DEFAULT_CODEC_OPTIONS, CodecOptions
+from bson.raw_bson import RawBSONDocument
 from pymongo.collection import Collection
 from pymongo.errors import OperationFailure
 
 _logger = logging.getLogger(__name__)
 
+# a little below the 16MB BSON document / 48MB message limits
+_default_chunk_bytes = 8 * 1024 * 1024
+
 
 def batch_insert(c: Collection, records: Iterable[dict]):
     with c.database.client.start_session() as session:
@@ -68,3 +77,134 @@ def batch_delete(c: Collection, filtr: dict | list):
                 session.abort_transaction()
                 raise
             return dr
+
+
+def encode_documents(
+    records: Iterable[dict], codec_options: CodecOptions = DEFAULT_CODEC_OPTIONS
+) -> Iterator[RawBSONDocument]:
+    """Encode each record once, for both `iter_chunks(max_bytes=...)`
+    and `insert_many`. Like `insert_many`, adds an `_id` to dicts without.
+    """
+    for rec in records:
+        if isinstance(rec, RawBSONDocument):
+            yield rec
+            continue
+        if "_id" not in rec:
+            rec["_id"] = ObjectId()
+        yield RawBSONDocument(bson.encode(rec, codec_options=codec_options))
+
+
+def _get_encoded_size(rec) -> int:
+    if isinstance(rec, RawBSONDocument):
+        return len(rec.raw)
+    return len(bson.encode(rec))
+
+
+def iter_chunks(
+    records: Iterable[dict], size: int = 1000, max_bytes: int = None
+) -> Iterator[list[dict]]:
+    """Pull records lazily and group them into lists.
+
+    A chunk is closed when it holds `size` records or when its encoded
+    BSON size would exceed `max_bytes`; a single oversized record still
+    forms a chunk of its own. Pass records through `encode_documents()`
+    to avoid encoding them twice.
+    """
+    chunk = []
+    nbytes = 0
+    for rec in records:
+        if max_bytes:
+            n = _get_encoded_size(rec)
+            if chunk and nbytes + n > max_bytes:
+                yield chunk
+                chunk = []
+                nbytes = 0
+            nbytes += n
+        chunk.append(rec)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+            nbytes = 0
+    if chunk:
+        yield chunk
+
+
+@dataclasses.dataclass
+class BatchProgress:
+    chunks: int = 0
+    inserted: int = 0
+    duplicates: int = 0
+    last_chunk_size: int = 0
+    started_at: float = dataclasses.field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """inserted records per second"""
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return self.inserted / elapsed
+
+    def to_dict(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+        }
+
+
+def _insert_chunk(c: Collection, chunk: list[dict], transaction: bool) -> int:
+    if not transaction:
+        return len(c.insert_many(chunk, ordered=False).inserted_ids)
+    with c.database.client.start_session() as session:
+        with session.start_transaction():
+            ir = c.insert_many(chunk, ordered=False, session=session)
+    return len(ir.inserted_ids)
+
+
+def stream_insert(
+    c: Collection,
+    records: Iterable[dict],
+    chunk_size: int = 1000,
+    chunk_bytes: int = _default_chunk_bytes,
+    transaction: bool = False,
+    callback: Callable[[BatchProgress], None] = None,
+) -> BatchProgress:
+    """Insert an arbitrarily large iterable of records with flat memory.
+
+    Unlike `batch_insert`, records are consumed chunk by chunk, and each
+    chunk is written as one unordered `insert_many` -- or, with
+    `transaction=True`, inside a transaction of its own. Atomicity is
+    therefore per chunk, not for the whole input.
+
+    Args:
+        c: target collection
+        records: any iterable, typically a generator or a cursor
+        chunk_size: max number of records per chunk
+        chunk_bytes: max encoded BSON size per chunk
+        transaction: wrap each chunk in a transaction
+        callback: called with the progress after each chunk
+    """
+    progress = BatchProgress()
+    if chunk_bytes:
+        records = encode_documents(records, c.codec_options)
+    for chunk in iter_chunks(records, chunk_size, chunk_bytes):
+        progress.inserted += _insert_chunk(c, chunk, transaction)
+        progress.chunks += 1
+        progress.last_chunk_size = len(chunk)
+        _logger.info(
+            "inserted chunk #%s into %s, %s records, %.1f records/s",
+            progress.chunks,
+            c.full_name,
+            len(chunk),
+            progress.throughput,
+        )
+        if callback is not None:
+            callback(progress)
+    return progress
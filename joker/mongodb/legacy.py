@@ -3,10 +3,13 @@
 """This module is DEPRECATED."""
 from __future__ import annotations
 
+import gzip
+import threading
+from functools import cached_property
 from collections import defaultdict
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Union
 
-import pymongo.errors
 from bson import ObjectId, json_util
 from gridfs import GridFS
 from pymongo import MongoClient
@@ -16,7 +19,12 @@ from pymongo.database import Database
 from volkanic.utils import printerr
 
 from joker.mongodb import utils
+from joker.mongodb.batch import _default_chunk_bytes, encode_documents, iter_chunks
+from joker.mongodb.logger import ConnectionPoolStats
 from joker.mongodb.tools import kvstore
+from joker.mongodb.tools.copying import insert_ignoring_duplicates
+from joker.mongodb.tools.dumpfiles import iter_raw_documents
+from joker.mongodb.tools.storage import StorageInspector
 
 
 class DatabaseInterface:
@@ -139,6 +147,8 @@ class MongoInterface:
         self.hosts = hosts
         self.aliases = aliases or {}
         self._clients = {}
+        self._pool_stats = {}
+        self._lock = threading.Lock()
 
     @classmethod
     def from_config(cls, options: dict):
@@ -148,6 +158,10 @@ class MongoInterface:
         }
         return cls(options, **params)
 
+    @staticmethod
+    def _create_client(params: dict) -> MongoClient:
+        return MongoClient(**params)
+
     def get_mongo(self, host: str = None) -> MongoClient:
         if host is None:
             host = self.default_host
@@ -155,11 +169,51 @@ class MongoInterface:
             return self._clients[host]
         except KeyError:
             pass
-        # host pass through as MongoClient argument
-        params = self.hosts.get(host, host)
-        if isinstance(params, str):
-            params = {"host": params}
-        return self._clients.setdefault(host, MongoClient(**params))
+        # a client owns a connection pool and monitor threads;
+        # create exactly one per host even under concurrency
+        with self._lock:
+            try:
+                return self._clients[host]
+            except KeyError:
+                pass
+            # host pass through as MongoClient argument
+            params = self.hosts.get(host, host)
+            if isinstance(params, str):
+                params = {"host": params}
+            stats = ConnectionPoolStats()
+            params = dict(params)
+            params["event_listeners"] = [*params.get("event_listeners", []), stats]
+            client = self._create_client(params)
+            self._pool_stats[host] = stats
+            self._clients[host] = client
+            return client
+
+    def _warm_up_host(self, host: str):
+        client = self.get_mongo(host)
+        pool_opts = client.options.pool_options
+        # concurrent pings need as many connections as min_pool_size
+        count = max(1, pool_opts.min_pool_size)
+        with ThreadPoolExecutor(count) as executor:
+            futures = [
+                executor.submit(client.admin.command, "ping") for _ in range(count)
+            ]
+            for fut in futures:
+                fut.result()
+
+    def warm_up(self, hosts: list[str] = None):
+        """Connect to all (or given) configured hosts at startup,
+        opening `minPoolSize` connections to each"""
+        if hosts is None:
+            hosts = list(self.hosts)
+        if not hosts:
+            return
+        with ThreadPoolExecutor(len(hosts)) as executor:
+            for _ in executor.map(self._warm_up_host, hosts):
+                pass
+
+    def get_pool_stats(self) -> dict[str, dict]:
+        """Connection pool statistics, by host and then by server address"""
+        return {host: stats.snapshot() for host, stats in self._pool_stats.items()}
 
     @property
     def db(self) -> Database:
@@ -210,12 +264,22 @@ class MongoInterfaceExtended(MongoInterface):
         target = self._get_target(host, db_name)
         return utils.print_mongo_storage_sizes(target)
 
+    @cached_property
+    def storage_inspector(self) -> StorageInspector:
+        """Inspect all hosts concurrently, with cached results"""
+        return StorageInspector.from_mongoi(self)
+
     def get_ci(self, *names, **kwargs) -> CollectionInterface:
         coll = self.__call__(*names)
         return CollectionInterface(coll, **kwargs)
 
-    # TODO: support BSON
-    def restore_a_file(self, lines, inner_path: str, empty_coll_only=True):
+    def _restore_documents(
+        self,
+        docs: Iterable[dict],
+        inner_path: str,
+        empty_coll_only=True,
+        batch_size=1000,
+    ):
         host, db_name, coll_name = utils.infer_coll_triple_from_filename(inner_path)
         if coll_name == "system.indexes":
             return
@@ -223,13 +287,41 @@ class MongoInterfaceExtended(MongoInterface):
         if empty_coll_only and coll.find_one(projection=[]):
             printerr(inner_path, "skipped")
             return
-        for ix, line in enumerate(lines):
-            doc = json_util.loads(line)
-            id_ = doc.get("_id", "")
-            printerr(inner_path, ix, id_, "...", end=" ")
-            try:
-                coll.insert_one(doc)
-            except pymongo.errors.DuplicateKeyError:
-                printerr("DuplicateKeyError")
-            else:
-                printerr("completed")
+        inserted = dup_count = 0
+        docs = encode_documents(docs, coll.codec_options)
+        for chunk in iter_chunks(docs, batch_size, _default_chunk_bytes):
+            n, dups = insert_ignoring_duplicates(coll, chunk)
+            inserted += n
+            dup_count += dups
+        printerr(inner_path, "inserted:", inserted, "DuplicateKeyError:", dup_count)
+        return {"inserted": inserted, "duplicates": dup_count}
+
+    def restore_a_file(self, lines, inner_path: str, empty_coll_only=True):
+        """Restore from lines of extended JSON, with batched insert_many"""
+        docs = (json_util.loads(line) for line in lines if line.strip())
+        return self._restore_documents(docs, inner_path, empty_coll_only)
+
+    def restore_a_path(self, path: utils.Pathlike, empty_coll_only=True):
+        """Restore from a .json or .bson file, optionally gzipped
+
+        File names are like "host.db_name.coll_name.xxx.json".
+        """
+        path = str(path)
+        inner_path = path[:-3] if path.endswith(".gz") else path
+        opener = gzip.open if path.endswith(".gz") else open
+        if inner_path.endswith(".bson"):
+            with opener(path, "rb") as fin:
+                # raw BSON frames go to insert_many without decoding
+                docs = iter_raw_documents(fin)
+                return self._restore_documents(docs, inner_path, empty_coll_only)
+        with opener(path, "rt") as fin:
+            return self.restore_a_file(fin, inner_path, empty_coll_only)
+
+    def restore_paths(self, paths: list, empty_coll_only=True, workers=4) -> dict:
+        """Restore files concurrently; returns results by path"""
+
+        def restore(p):
+            return self.restore_a_path(p, empty_coll_only)
+
+        with ThreadPoolExecutor(workers) as executor:
+            return dict(zip(paths, executor.map(restore, paths)))
@@ -2,13 +2,19 @@
 # coding: utf-8
 from __future__ import annotations
 
+import bisect
 import logging
+import threading
+from collections import Counter, defaultdict
+
+import bson
 
 from pymongo.monitoring import (
     CommandListener,
     CommandStartedEvent,
     CommandSucceededEvent,
     CommandFailedEvent,
+    ConnectionPoolListener,
 )
 
 
@@ -61,3 +67,221 @@ class MongoCommandLogger(CommandListener):
         ]
         msg = " ".join(str(s) for s in parts)
         self._logger.debug(msg)
+
+
+class ConnectionPoolStats(ConnectionPoolListener):
+    """Count connection pool events per server address"""
+
+    def __init__(self):
+        self._counters = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def _incr(self, event, name: str):
+        addr = ":".join(str(s) for s in event.address)
+        with self._lock:
+            self._counters[addr][name] += 1
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            stats = {k: dict(v) for k, v in self._counters.items()}
+        for c in stats.values():
+            c["open"] = c.get("created", 0) - c.get("closed", 0)
+            c["in_use"] = c.get("checked_out", 0) - c.get("checked_in", 0)
+        return stats
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._incr(event, "cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._incr(event, "created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._incr(event, "closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._incr(event, "check_out_failed")
+
+    def connection_checked_out(self, event):
+        self._incr(event, "checked_out")
+
+    def connection_checked_in(self, event):
+        self._incr(event, "checked_in")
+
+
+def _infer_coll_name(command_name: str, command: dict):
+    if command_name == "getMore":
+        return command.get("collection")
+    val = command.get(command_name)
+    if isinstance(val, str):
+        return val
+
+
+class _LatencyHistogram:
+    __slots__ = ["buckets", "count", "sum", "errors", "reply_bytes"]
+
+    def __init__(self, n: int):
+        self.buckets = [0] * n
+        self.count = 0
+        self.sum = 0
+        self.errors = 0
+        self.reply_bytes = 0
+
+
+class MongoCommandMetrics(CommandListener):
+    """Latency histograms per (database, collection, command)
+
+    Register with `MongoClient(event_listeners=[metrics])`.
+    When `enabled` is False, events are not recorded; commands started
+    while enabled are still cleared from the pending ones when they end.
+    """
+
+    # upper bounds of buckets, in microseconds
+    bounds = [
+        100, 250, 500,
+        1_000, 2_500, 5_000,
+        10_000, 25_000, 50_000,
+        100_000, 250_000, 500_000,
+        1_000_000, 2_500_000, 5_000_000, 10_000_000,
+    ]
+
+    def __init__(self, enabled: bool = True, track_reply_size: bool = False):
+        self.enabled = enabled
+        self.track_reply_size = track_reply_size
+        self._pending = {}
+        self._histograms: dict[tuple, _LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _event_key(event):
+        return event.request_id, event.connection_id
+
+    def _get_histogram(self, key: tuple) -> _LatencyHistogram:
+        try:
+            return self._histograms[key]
+        except KeyError:
+            hist = _LatencyHistogram(len(self.bounds) + 1)
+            return self._histograms.setdefault(key, hist)
+
+    def started(self, event: CommandStartedEvent):
+        if not self.enabled:
+            return
+        coll_name = _infer_coll_name(event.command_name, event.command)
+        self._pending[self._event_key(event)] = coll_name
+
+    def _record(self, event, coll_name: str, error: bool, reply: dict = None):
+        key = event.database_name, coll_name, event.command_name
+        micros = event.duration_micros
+        idx = bisect.bisect_left(self.bounds, micros)
+        nbytes = 0
+        if reply is not None and self.track_reply_size:
+            nbytes = len(bson.encode(reply))
+        with self._lock:
+            hist = self._get_histogram(key)
+            hist.buckets[idx] += 1
+            hist.count += 1
+            hist.sum += micros
+            hist.reply_bytes += nbytes
+            if error:
+                hist.errors += 1
+
+    def succeeded(self, event: CommandSucceededEvent):
+        # pop even if disabled, or commands started before are never released
+        coll_name = self._pending.pop(self._event_key(event), None)
+        if self.enabled:
+            self._record(event, coll_name, False, event.reply)
+
+    def failed(self, event: CommandFailedEvent):
+        coll_name = self._pending.pop(self._event_key(event), None)
+        if self.enabled:
+            self._record(event, coll_name, True)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def _percentile(self, buckets: list[int], count: int, q: float) -> float:
+        """Estimate by linear interpolation within the bucket"""
+        rank = q * count
+        cumulative = 0
+        for idx, n in enumerate(buckets):
+            if cumulative + n >= rank and n:
+                lower = self.bounds[idx - 1] if idx else 0
+                upper = self.bounds[idx] if idx < len(self.bounds) else lower * 2
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return 0.0
+
+    def snapshot(self, quantiles=(0.5, 0.9, 0.99)) -> list[dict]:
+        """Latencies are in milliseconds"""
+        with self._lock:
+            items = [
+                (k, list(h.buckets), h.count, h.sum, h.errors, h.reply_bytes)
+                for k, h in self._histograms.items()
+            ]
+        rows = []
+        for (db, coll, cmd), buckets, count, total, errors, nbytes in items:
+            row = {
+                "database": db,
+                "collection": coll,
+                "command": cmd,
+                "count": count,
+                "errors": errors,
+                "mean": total / count / 1000 if count else 0.0,
+                "reply_bytes": nbytes,
+            }
+            for q in quantiles:
+                p = self._percentile(buckets, count, q)
+                row[f"p{q * 100:g}"] = p / 1000
+            rows.append(row)
+        rows.sort(key=lambda r: r["mean"] * r["count"], reverse=True)
+        return rows
+
+    @staticmethod
+    def _fmt_labels(labels: dict) -> str:
+        parts = []
+        for k, v in labels.items():
+            v = str(v).replace("\\", "\\\\").replace('"', '\\"')
+            parts.append(f'{k}="{v}"')
+        return "{" + ",".join(parts) + "}"
+
+    def to_prometheus(self, name="mongodb_command_duration_seconds") -> str:
+        with self._lock:
+            items = [
+                (k, list(h.buckets), h.count, h.sum, h.errors, h.reply_bytes)
+                for k, h in self._histograms.items()
+            ]
+        lines = [
+            f"# TYPE {name} histogram",
+        ]
+        err_lines = ["# TYPE mongodb_command_errors_total counter"]
+        size_lines = ["# TYPE mongodb_command_reply_bytes_total counter"]
+        for (db, coll, cmd), buckets, count, total, errors, nbytes in items:
+            labels = {"database": db, "collection": coll or "", "command": cmd}
+            cumulative = 0
+            for bound, n in zip(self.bounds, buckets):
+                cumulative += n
+                lb = self._fmt_labels({**labels, "le": f"{bound / 1e6:g}"})
+                lines.append(f"{name}_bucket{lb} {cumulative}")
+            lb = self._fmt_labels({**labels, "le": "+Inf"})
+            lines.append(f"{name}_bucket{lb} {count}")
+            lb = self._fmt_labels(labels)
+            lines.append(f"{name}_sum{lb} {total / 1e6:g}")
+            lines.append(f"{name}_count{lb} {count}")
+            err_lines.append(f"mongodb_command_errors_total{lb} {errors}")
+            size_lines.append(f"mongodb_command_reply_bytes_total{lb} {nbytes}")
+        return "\n".join(lines + err_lines + size_lines) + "\n"
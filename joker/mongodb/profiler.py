@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Union
+
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.monitoring import (
+    CommandListener,
+    CommandStartedEvent,
+    CommandSucceededEvent,
+    CommandFailedEvent,
+)
+
+_logger = logging.getLogger(__name__)
+
+# keys kept when a command is re-issued for explain
+_explainable_keys = {
+    "find": ["find", "filter", "sort", "projection", "hint", "skip", "limit", "collation"],
+    "aggregate": ["aggregate", "pipeline", "hint", "collation"],
+    "update": ["update", "updates"],
+    "delete": ["delete", "deletes"],
+}
+
+
+def redact(obj):
+    """Replace literal values with "?" while keeping field names and operators
+
+    >>> redact({"a": 1, "b": {"$in": [1, 2]}})
+    {'a': '?', 'b': {'$in': '?'}}
+    """
+    if isinstance(obj, dict):
+        return {k: redact(v) for k, v in obj.items()}
+    if isinstance(obj, list) and obj and all(isinstance(v, dict) for v in obj):
+        # e.g. pipelines and $or branches
+        return [redact(v) for v in obj]
+    return "?"
+
+
+def _iter_plan_stages(plan: dict):
+    yield plan
+    for key in ["inputStage", "queryPlan", "thenStage", "elseStage"]:
+        if isinstance(plan.get(key), dict):
+            yield from _iter_plan_stages(plan[key])
+    for sub_plan in plan.get("inputStages") or []:
+        yield from _iter_plan_stages(sub_plan)
+
+
+def _find_explained_query(explained: dict) -> dict | None:
+    """The sub-document holding queryPlanner and executionStats"""
+    if "queryPlanner" in explained:
+        return explained
+    # aggregate explained as {"stages": [{"$cursor": {"queryPlanner": ...}}]}
+    for stage in explained.get("stages") or []:
+        cursor = stage.get("$cursor")
+        if cursor:
+            return _find_explained_query(cursor)
+
+
+@dataclasses.dataclass
+class SlowCommandRecord:
+    database: str
+    collection: str
+    command: str
+    duration_ms: float
+    shape: dict
+    created_at: datetime.datetime = dataclasses.field(
+        default_factory=datetime.datetime.now
+    )
+    stages: list[str] = None
+    collscan: bool = None
+    in_memory_sort: bool = None
+    docs_examined: int = None
+    keys_examined: int = None
+    n_returned: int = None
+
+    def load_explain(self, explained: dict):
+        query = _find_explained_query(explained) or {}
+        plan = (query.get("queryPlanner") or {}).get("winningPlan")
+        if plan is not None:
+            self.stages = [p.get("stage") for p in _iter_plan_stages(plan)]
+            self.collscan = "COLLSCAN" in self.stages
+            self.in_memory_sort = "SORT" in self.stages
+        stats = query.get("executionStats") or {}
+        self.docs_examined = stats.get("totalDocsExamined")
+        self.keys_examined = stats.get("totalKeysExamined")
+        self.n_returned = stats.get("nReturned")
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+class SlowCommandProfiler(CommandListener):
+    """Capture slow commands and explain them in a background thread
+
+    Register with `MongoClient(event_listeners=[profiler])`, then set
+    `profiler.client` to a client used for explain, which may be the
+    same client. Each shape is explained at most once per
+    `explain_interval` seconds, and only for a `sample_rate` fraction.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = 100,
+        sample_rate: float = 1.0,
+        explain_interval: float = 600,
+        maxlen: int = 1000,
+        sink: Collection = None,
+        client: MongoClient = None,
+    ):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.explain_interval = explain_interval
+        self.records: deque[SlowCommandRecord] = deque(maxlen=maxlen)
+        # e.g. a capped collection
+        self.sink = sink
+        self.client = client
+        self._pending = {}
+        self._explained_at = {}
+        self._queue = queue.Queue(maxsize=100)
+        self._thread: Union[threading.Thread, None] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _event_key(event):
+        return event.request_id, event.connection_id
+
+    def started(self, event: CommandStartedEvent):
+        if event.command_name not in _explainable_keys:
+            return
+        self._pending[self._event_key(event)] = event.command
+
+    def succeeded(self, event: CommandSucceededEvent):
+        command = self._pending.pop(self._event_key(event), None)
+        if command is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+        self._capture(event, command, duration_ms)
+
+    def failed(self, event: CommandFailedEvent):
+        self._pending.pop(self._event_key(event), None)
+
+    def _capture(self, event, command: dict, duration_ms: float):
+        keys = _explainable_keys[event.command_name]
+        stripped = {k: command[k] for k in keys if k in command}
+        record = SlowCommandRecord(
+            database=event.database_name,
+            collection=command.get(event.command_name),
+            command=event.command_name,
+            duration_ms=duration_ms,
+            shape=redact(stripped),
+        )
+        if self._should_explain(record):
+            if event.command_name == "aggregate":
+                stripped["cursor"] = {}
+            try:
+                self._queue.put_nowait((record, stripped))
+                self._ensure_thread()
+                return
+            except queue.Full:
+                pass
+        self._save(record)
+
+    def _should_explain(self, record: SlowCommandRecord) -> bool:
+        if self.client is None or random.random() >= self.sample_rate:
+            return False
+        key = record.database, json_util.dumps(record.shape)
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained_at.get(key)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._explained_at[key] = now
+        return True
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._work, daemon=True)
+            self._thread.start()
+
+    def _explain(self, record: SlowCommandRecord, command: dict):
+        db = self.client.get_database(record.database)
+        explained = db.command(
+            {"explain": command, "verbosity": "executionStats"}
+        )
+        record.load_explain(explained)
+
+    def _work(self):
+        while True:
+            record, command = self._queue.get()
+            # noinspection PyBroadException
+            try:
+                self._explain(record, command)
+            except Exception:
+                _logger.warning("failed to explain %s", record.shape, exc_info=True)
+            self._save(record)
+
+    def _save(self, record: SlowCommandRecord):
+        self.records.append(record)
+        if self.sink is None:
+            return
+        # noinspection PyBroadException
+        try:
+            self.sink.insert_one(record.to_dict())
+        except Exception:
+            _logger.warning("failed to save slow command record", exc_info=True)
+
+    def get_records(self) -> list[dict]:
+        return [r.to_dict() for r in list(self.records)]
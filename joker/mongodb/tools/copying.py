@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pymongo.errors
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from joker.mongodb.batch import BatchProgress, iter_chunks
+from joker.mongodb.tools.kvstore import _CheckpointStore
+
+_logger = logging.getLogger(__name__)
+
+
+def insert_ignoring_duplicates(coll: Collection, records: list) -> tuple[int, int]:
+    """Insert with one unordered `insert_many`, skipping duplicate keys
+
+    Returns:
+        (number of inserted, number of duplicates)
+    """
+    if not records:
+        return 0, 0
+    try:
+        ir = coll.insert_many(records, ordered=False)
+    except pymongo.errors.BulkWriteError as exc:
+        errors = exc.details["writeErrors"]
+        other_errors = [e for e in errors if e["code"] != 11000]
+        if other_errors or exc.details["writeConcernErrors"]:
+            raise
+        dup_count = len(errors)
+        return exc.details["nInserted"], dup_count
+    return len(ir.inserted_ids), 0
+
+
+def split_id_ranges(coll: Collection, filtr: dict, parts: int, samples_per_part=20):
+    """Split into `parts` ranges of _id, with boundaries from a `$sample`
+
+    Returns:
+        a list of (lower, upper) pairs; None means unbounded
+    """
+    if parts <= 1:
+        return [(None, None)]
+    pipeline = [
+        {"$match": filtr},
+        {"$sample": {"size": parts * samples_per_part}},
+        {"$project": {"_id": True}},
+    ]
+    ids = sorted({doc["_id"] for doc in coll.aggregate(pipeline)})
+    if not ids:
+        return [(None, None)]
+    step = len(ids) / parts
+    bounds = [ids[int(i * step)] for i in range(1, parts)]
+    bounds = sorted(set(bounds))
+    lowers = [None, *bounds]
+    uppers = [*bounds, None]
+    return list(zip(lowers, uppers))
+
+
+class CollectionCopier:
+    """Copy documents between collections, in parallel by _id ranges
+
+    Each range is read in `_id` order and written with unordered
+    `insert_many` batches; duplicate keys on the target are skipped.
+    With `raw=True`, documents pass through as RawBSONDocument without
+    being decoded. With a checkpoint store (e.g. a KVStore), the range
+    boundaries and the last copied `_id` of each range are saved, so an
+    interrupted copy resumes where it stopped; they are cleared once the
+    copy completes. Call `reset()` to start an interrupted copy afresh.
+    """
+
+    def __init__(
+        self,
+        source: Collection,
+        target: Collection,
+        filtr: dict = None,
+        workers: int = 8,
+        batch_size: int = 1000,
+        raw: bool = False,
+        checkpoint_store: _CheckpointStore = None,
+    ):
+        if raw:
+            opts = CodecOptions(document_class=RawBSONDocument)
+            source = source.with_options(codec_options=opts)
+        self.source = source
+        self.target = target
+        self.filtr = filtr or {}
+        self.workers = workers
+        self.batch_size = batch_size
+        self.raw = raw
+        self.checkpoint_store = checkpoint_store
+        self.checkpoint_key = f"copy:{source.full_name}:{target.full_name}"
+        self.progress = BatchProgress()
+        self._lock = threading.Lock()
+
+    def _load_checkpoint(self, suffix: str):
+        if self.checkpoint_store is None:
+            return
+        return self.checkpoint_store.load(f"{self.checkpoint_key}:{suffix}")
+
+    def _save_checkpoint(self, suffix: str, value):
+        if self.checkpoint_store is None:
+            return
+        self.checkpoint_store.save(f"{self.checkpoint_key}:{suffix}", value)
+
+    def reset(self):
+        """Clear the checkpoints"""
+        ranges = self._load_checkpoint("ranges") or []
+        for idx in range(len(ranges)):
+            self._save_checkpoint(idx, None)
+        self._save_checkpoint("ranges", None)
+
+    def _get_ranges(self) -> list:
+        ranges = self._load_checkpoint("ranges")
+        if ranges is None:
+            ranges = split_id_ranges(self.source, self.filtr, self.workers)
+            self._save_checkpoint("ranges", [list(r) for r in ranges])
+        return ranges
+
+    def _copy_range(self, idx: int, lower, upper):
+        id_cond = {}
+        resumed_from = self._load_checkpoint(idx)
+        if resumed_from is not None:
+            id_cond["$gt"] = resumed_from
+        elif lower is not None:
+            id_cond["$gte"] = lower
+        if upper is not None:
+            id_cond["$lt"] = upper
+        filtr = dict(self.filtr)
+        if id_cond:
+            filtr = {"$and": [filtr, {"_id": id_cond}]}
+        cursor = self.source.find(filtr, sort=[("_id", 1)], batch_size=self.batch_size)
+        for chunk in iter_chunks(cursor, self.batch_size):
+            inserted, dups = insert_ignoring_duplicates(self.target, chunk)
+            self._save_checkpoint(idx, chunk[-1]["_id"])
+            with self._lock:
+                self.progress.chunks += 1
+                self.progress.inserted += inserted
+                self.progress.duplicates += dups
+                self.progress.last_chunk_size = len(chunk)
+            _logger.info(
+                "copied %s docs to %s, %.1f docs/s",
+                self.progress.inserted,
+                self.target.full_name,
+                self.progress.throughput,
+            )
+
+    def run(self) -> BatchProgress:
+        ranges = self._get_ranges()
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = [
+                executor.submit(self._copy_range, idx, lower, upper)
+                for idx, (lower, upper) in enumerate(ranges)
+            ]
+            for fut in futures:
+                fut.result()
+        # a later run with the same store is a new copy
+        self.reset()
+        return self.progress
+
+
+class GridFSCopier:
+    """Copy GridFS files matching a filter on `<bucket>.files`
+
+    Chunks are copied as raw BSON with bulk inserts, files in batches
+    across a thread pool. A file whose length (and md5, if recorded)
+    already matches on the target is skipped. The files document is
+    written after its chunks, so a file never appears half-copied.
+    """
+
+    # about 32 chunks of 255KB per insert_many
+    _chunk_batch_bytes = 8 * 1024 * 1024
+
+    def __init__(
+        self,
+        source_db: Database,
+        target_db: Database,
+        bucket: str = "fs",
+        workers: int = 8,
+        batch_size: int = 100,
+    ):
+        opts = CodecOptions(document_class=RawBSONDocument)
+        self.source_files = source_db.get_collection(f"{bucket}.files")
+        self.source_chunks = source_db.get_collection(
+            f"{bucket}.chunks", codec_options=opts
+        )
+        self.target_files = target_db.get_collection(f"{bucket}.files")
+        self.target_chunks = target_db.get_collection(f"{bucket}.chunks")
+        self.workers = workers
+        self.batch_size = batch_size
+        self.progress = BatchProgress()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_same(source_file: dict, target_file: dict) -> bool:
+        if source_file.get("length") != target_file.get("length"):
+            return False
+        md5 = source_file.get("md5")
+        return md5 is None or md5 == target_file.get("md5")
+
+    def _find_outdated(self, files: list[dict]) -> list[dict]:
+        ids = [f["_id"] for f in files]
+        target_files = {
+            f["_id"]: f
+            for f in self.target_files.find(
+                {"_id": {"$in": ids}}, {"length": True, "md5": True}
+            )
+        }
+        outdated = []
+        for f in files:
+            target_file = target_files.get(f["_id"])
+            if target_file is None or not self._is_same(f, target_file):
+                outdated.append(f)
+        return outdated
+
+    def _copy_files(self, files: list[dict]):
+        outdated = self._find_outdated(files)
+        skipped = len(files) - len(outdated)
+        if outdated:
+            ids = [f["_id"] for f in outdated]
+            # remove stale or partially copied files first
+            self.target_files.delete_many({"_id": {"$in": ids}})
+            self.target_chunks.delete_many({"files_id": {"$in": ids}})
+            chunks = self.source_chunks.find(
+                {"files_id": {"$in": ids}}, sort=[("files_id", 1), ("n", 1)]
+            )
+            for batch in iter_chunks(chunks, 1000, self._chunk_batch_bytes):
+                self.target_chunks.insert_many(batch, ordered=False)
+            self.target_files.insert_many(outdated, ordered=False)
+        with self._lock:
+            self.progress.chunks += 1
+            self.progress.inserted += len(outdated)
+            self.progress.duplicates += skipped
+            self.progress.last_chunk_size = len(files)
+        _logger.info(
+            "copied %s files to %s, skipped %s, %.1f files/s",
+            self.progress.inserted,
+            self.target_files.full_name,
+            self.progress.duplicates,
+            self.progress.throughput,
+        )
+
+    def run(self, filtr: dict = None) -> BatchProgress:
+        """Returns progress; `duplicates` counts files skipped as identical"""
+        files = self.source_files.find(filtr or {}, sort=[("_id", 1)])
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = set()
+            for batch in iter_chunks(files, self.batch_size):
+                futures.add(executor.submit(self._copy_files, batch))
+                # bound the number of batches held in memory
+                if len(futures) >= self.workers * 2:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        fut.result()
+            for fut in futures:
+                fut.result()
+        return self.progress
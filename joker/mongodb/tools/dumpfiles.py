@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""Read and write the mongodump directory layout without mongodump:
+
+    <dir>/<db>/<coll>.bson.gz
+    <dir>/<db>/<coll>.metadata.json.gz
+"""
+from __future__ import annotations
+
+import gzip
+import logging
+import struct
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+import bson
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.json_util import CANONICAL_JSON_OPTIONS
+from bson.raw_bson import RawBSONDocument
+from pymongo import IndexModel
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from joker.mongodb.batch import _default_chunk_bytes, iter_chunks
+from joker.mongodb.tools.copying import insert_ignoring_duplicates
+from joker.mongodb.utils import Pathlike
+
+_logger = logging.getLogger(__name__)
+
+_raw_codec_options = CodecOptions(document_class=RawBSONDocument)
+
+
+def iter_raw_documents(fin: BinaryIO) -> Iterator[RawBSONDocument]:
+    """Read length-prefixed BSON documents one at a time"""
+    while True:
+        head = fin.read(4)
+        if not head:
+            return
+        if len(head) < 4:
+            raise ValueError("truncated BSON length prefix")
+        (size,) = struct.unpack("<i", head)
+        body = fin.read(size - 4)
+        if len(body) != size - 4:
+            raise ValueError("truncated BSON document")
+        yield RawBSONDocument(head + body, _raw_codec_options)
+
+
+def write_documents(fout: BinaryIO, docs: Iterable) -> int:
+    count = 0
+    for doc in docs:
+        if isinstance(doc, RawBSONDocument):
+            fout.write(doc.raw)
+        else:
+            fout.write(bson.encode(doc))
+        count += 1
+    return count
+
+
+def _open(path: Path, mode: str):
+    if path.suffix == ".gz":
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _index_models_from_metadata(metadata: dict) -> list[IndexModel]:
+    models = []
+    for spec in metadata.get("indexes") or []:
+        if spec.get("name") == "_id_":
+            continue
+        options = {k: v for k, v in spec.items() if k not in ("key", "v", "ns")}
+        models.append(IndexModel(list(spec["key"].items()), **options))
+    return models
+
+
+def _create_collection(target: Collection, options: dict):
+    """Create with dumped options (capped, validator, collation, timeseries,
+    etc.), unless the collection exists"""
+    if not options:
+        return
+    db = target.database
+    if db.list_collection_names(filter={"name": target.name}):
+        return
+    db.create_collection(target.name, **options)
+
+
+class DumpDirectory:
+    def __init__(self, dir_: Pathlike, gzip_: bool = True):
+        self.dir_ = Path(dir_)
+        self.gzip_ = gzip_
+
+    def _get_path(self, db_name: str, coll_name: str, suffix: str) -> Path:
+        path = self.dir_ / db_name / f"{coll_name}{suffix}"
+        if self.gzip_:
+            path = path.with_name(path.name + ".gz")
+        return path
+
+    def _find_path(self, db_name: str, coll_name: str, suffix: str) -> Path:
+        # a directory may hold plain and gzipped files regardless of `gzip_`
+        path = self._get_path(db_name, coll_name, suffix)
+        if path.exists():
+            return path
+        if self.gzip_:
+            other = path.with_name(path.name[:-3])
+        else:
+            other = path.with_name(path.name + ".gz")
+        return other if other.exists() else path
+
+    def list_namespaces(self) -> list[tuple[str, str]]:
+        names = {}
+        for path in sorted(self.dir_.glob("*/*.bson*")):
+            name = path.name
+            for suffix in (".bson.gz", ".bson"):
+                if name.endswith(suffix):
+                    names[path.parent.name, name[: -len(suffix)]] = None
+                    break
+        # a collection dumped both plain and gzipped is listed once
+        return list(names)
+
+    def iter_documents(self, db_name: str, coll_name: str) -> Iterator[RawBSONDocument]:
+        path = self._find_path(db_name, coll_name, ".bson")
+        with _open(path, "rb") as fin:
+            yield from iter_raw_documents(fin)
+
+    def load_metadata(self, db_name: str, coll_name: str) -> dict:
+        path = self._find_path(db_name, coll_name, ".metadata.json")
+        if not path.exists():
+            return {}
+        with _open(path, "rb") as fin:
+            return json_util.loads(fin.read())
+
+    def dump_collection(self, coll: Collection, filtr: dict = None) -> int:
+        db_name = coll.database.name
+        path = self._get_path(db_name, coll.name, ".bson")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        raw_coll = coll.with_options(codec_options=_raw_codec_options)
+        with _open(path, "wb") as fout:
+            count = write_documents(fout, raw_coll.find(filtr or {}))
+        metadata = {
+            "indexes": list(coll.list_indexes()),
+            "collectionName": coll.name,
+            "type": "collection",
+            "options": coll.options(),
+        }
+        path = self._get_path(db_name, coll.name, ".metadata.json")
+        with _open(path, "wb") as fout:
+            text = json_util.dumps(metadata, json_options=CANONICAL_JSON_OPTIONS)
+            fout.write(text.encode("utf-8"))
+        _logger.info("dumped %s documents of %s", count, coll.full_name)
+        return count
+
+    def dump_database(self, db: Database, excl_coll_names: Iterable[str] = ()):
+        excl_coll_names = set(excl_coll_names)
+        counts = {}
+        for coll_name in db.list_collection_names(filter={"type": "collection"}):
+            if coll_name in excl_coll_names or coll_name.startswith("system."):
+                continue
+            counts[coll_name] = self.dump_collection(db[coll_name])
+        return counts
+
+    def restore_collection(
+        self,
+        db_name: str,
+        coll_name: str,
+        target: Collection,
+        drop: bool = False,
+        batch_size: int = 1000,
+    ) -> dict:
+        if drop:
+            target.drop()
+        metadata = self.load_metadata(db_name, coll_name)
+        _create_collection(target, metadata.get("options"))
+        inserted = dup_count = 0
+        docs = self.iter_documents(db_name, coll_name)
+        for chunk in iter_chunks(docs, batch_size, _default_chunk_bytes):
+            n, dups = insert_ignoring_duplicates(target, chunk)
+            inserted += n
+            dup_count += dups
+        models = _index_models_from_metadata(metadata)
+        if models:
+            target.create_indexes(models)
+        _logger.info("restored %s documents into %s", inserted, target.full_name)
+        return {"inserted": inserted, "duplicates": dup_count}
+
+    def restore(self, client, drop: bool = False) -> dict:
+        """Restore every collection under the directory, like mongorestore"""
+        results = {}
+        for db_name, coll_name in self.list_namespaces():
+            target = client.get_database(db_name).get_collection(coll_name)
+            results[f"{db_name}.{coll_name}"] = self.restore_collection(
+                db_name, coll_name, target, drop=drop
+            )
+        return results
@@ -5,9 +5,24 @@ from __future__ import annotations
 from typing import List
 from joker.mongodb.tools.cmdline import CommandOptionDictMongoish
 
+import gzip
+import logging
 import re
+from pathlib import Path
+
+from bson import json_util
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.collection import Collection
 from pymongo.database import Database
 from joker.mongodb import utils
+from joker.mongodb.batch import iter_chunks
+from joker.mongodb.tools.dumpfiles import (
+    DumpDirectory,
+    iter_raw_documents,
+    write_documents,
+)
+
+_logger = logging.getLogger(__name__)
 
 
 def find_excluding_coll_names(db: Database, regexes: List[str]) -> list:
@@ -40,3 +55,153 @@ def smart_dump(db: Database, outpath: str, excl_regexes: List[str]):
             params[key] = val
     return params
     # dump(params)
+
+
+def dump_in_process(db: Database, outpath: str, excl_regexes: List[str]) -> dict:
+    """Like mongodump with the parameters from smart_dump(), in Python"""
+    excl_coll_names = find_excluding_coll_names(db, excl_regexes)
+    return DumpDirectory(outpath).dump_database(db, excl_coll_names)
+
+
+class IncrementalDumper:
+    """Dump only documents newer than a per-collection watermark
+
+    Layout under `outpath`:
+        watermarks.json                   -- watermark and seq by namespace
+        <db>/<coll>/<seq>.bson.gz         -- new or changed documents
+        <db>/<coll>/<seq>.deleted.bson.gz -- {_id: ...} of deleted documents
+
+    Seq 0 is a full dump, including documents without the field.
+    Watermark modes:
+        field="_id" -- max ObjectId; for append-only collections
+        field="updated_at" -- any indexed, increasing field
+        field=None  -- oplog ts; catches updates and deletions, also those
+                       inside transactions; raises RuntimeError if the
+                       oplog has rolled past the last watermark
+    """
+
+    def __init__(self, outpath: utils.Pathlike, field: str = "_id"):
+        self.dir_ = Path(outpath)
+        self.field = field
+        self._watermarks_path = self.dir_ / "watermarks.json"
+
+    def load_watermarks(self) -> dict:
+        try:
+            return json_util.loads(self._watermarks_path.read_text())
+        except FileNotFoundError:
+            return {}
+
+    def _save_watermarks(self, watermarks: dict):
+        self.dir_.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._watermarks_path.with_suffix(".tmp")
+        tmp_path.write_text(json_util.dumps(watermarks, indent=1))
+        tmp_path.replace(self._watermarks_path)
+
+    @staticmethod
+    def _write(path: Path, docs) -> int:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wb") as fout:
+            return write_documents(fout, docs)
+
+    def _get_delta_by_field(self, coll: Collection, lo):
+        top = coll.find_one(
+            {self.field: {"$exists": True}},
+            projection={self.field: True},
+            sort=[(self.field, -1)],
+        )
+        hi = lo if top is None else top[self.field]
+        if lo is None:
+            return hi, coll.find({}), []
+        return hi, coll.find({self.field: {"$gt": lo, "$lte": hi}}), []
+
+    @staticmethod
+    def _iter_changed_ids(oplog: Collection, ns: str, lo, hi):
+        # writes in a transaction are nested in applyOps entries of admin.$cmd
+        filtr = {
+            "ts": {"$gt": lo, "$lte": hi},
+            "$or": [{"ns": ns}, {"ns": "admin.$cmd", "o.applyOps.ns": ns}],
+        }
+        for entry in oplog.find(filtr):
+            if entry["ns"] == ns:
+                ops = [entry]
+            else:
+                ops = [op for op in entry["o"]["applyOps"] if op.get("ns") == ns]
+            for op in ops:
+                id_ = (op.get("o2") or op.get("o") or {}).get("_id")
+                if id_ is not None:
+                    yield id_
+
+    @staticmethod
+    def _iter_documents_by_ids(coll: Collection, ids: list, deleted: list):
+        found = set()
+        for chunk in iter_chunks(ids, 1000):
+            for doc in coll.find({"_id": {"$in": chunk}}):
+                found.add(repr(doc["_id"]))
+                yield doc
+        deleted.extend({"_id": i} for i in ids if repr(i) not in found)
+
+    def _get_delta_by_oplog(self, coll: Collection, lo):
+        oplog = coll.database.client.get_database("local").get_collection("oplog.rs")
+        top = oplog.find_one({}, projection={"ts": True}, sort=[("$natural", -1)])
+        hi = top["ts"]
+        if lo is None:
+            return hi, coll.find({}), []
+        bottom = oplog.find_one({}, projection={"ts": True}, sort=[("$natural", 1)])
+        if bottom["ts"] > lo:
+            msg = f"oplog of {coll.full_name} has rolled past watermark {lo}"
+            raise RuntimeError(msg)
+        ids = {}
+        for id_ in self._iter_changed_ids(oplog, coll.full_name, lo, hi):
+            ids[repr(id_)] = id_
+        # filled once the documents are exhausted
+        deleted = []
+        docs = self._iter_documents_by_ids(coll, list(ids.values()), deleted)
+        return hi, docs, deleted
+
+    def dump_collection(self, coll: Collection) -> dict:
+        watermarks = self.load_watermarks()
+        ns = coll.full_name
+        entry = watermarks.get(ns) or {"seq": -1, "value": None}
+        lo = entry["value"]
+        if self.field is None:
+            hi, docs, deleted = self._get_delta_by_oplog(coll, lo)
+        else:
+            hi, docs, deleted = self._get_delta_by_field(coll, lo)
+        seq = entry["seq"] + 1
+        coll_dir = self.dir_ / coll.database.name / coll.name
+        count = self._write(coll_dir / f"{seq:06d}.bson.gz", docs)
+        if deleted:
+            self._write(coll_dir / f"{seq:06d}.deleted.bson.gz", deleted)
+        watermarks[ns] = {"seq": seq, "value": hi, "field": self.field}
+        self._save_watermarks(watermarks)
+        _logger.info("dumped %s documents of %s, seq %s", count, ns, seq)
+        return {"seq": seq, "count": count, "deleted": len(deleted)}
+
+    def dump_database(self, db: Database, excl_regexes: List[str] = ()) -> dict:
+        excl_coll_names = set(find_excluding_coll_names(db, excl_regexes))
+        results = {}
+        for coll_name in db.list_collection_names(filter={"type": "collection"}):
+            if coll_name in excl_coll_names or coll_name.startswith("system."):
+                continue
+            results[coll_name] = self.dump_collection(db[coll_name])
+        return results
+
+    def restore_collection(self, db_name: str, coll_name: str, target: Collection):
+        """Apply the full dump and then every delta, in order"""
+        coll_dir = self.dir_ / db_name / coll_name
+        for path in sorted(coll_dir.glob("*.bson.gz")):
+            with gzip.open(path, "rb") as fin:
+                docs = iter_raw_documents(fin)
+                if path.name.endswith(".deleted.bson.gz"):
+                    ops = (DeleteOne({"_id": d["_id"]}) for d in docs)
+                else:
+                    ops = (ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs)
+                for chunk in iter_chunks(ops, 1000):
+                    target.bulk_write(chunk, ordered=False)
+            _logger.info("applied %s to %s", path, target.full_name)
+
+    def restore(self, client) -> None:
+        for ns in self.load_watermarks():
+            db_name, coll_name = ns.split(".", 1)
+            target = client.get_database(db_name).get_collection(coll_name)
+            self.restore_collection(db_name, coll_name, target)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import bz2
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import logging
+import lzma
+from typing import Iterable, Iterator
+
+from bson import ObjectId, json_util
+
+from joker.mongodb.batch import iter_chunks
+from joker.mongodb.utils import Pathlike
+
+_logger = logging.getLogger(__name__)
+
+_buffer_size = 1024 * 1024
+
+
+def flatten(doc: dict, sep: str = ".", prefix: str = "") -> dict:
+    """
+    >>> flatten({"a": {"b": 1, "c": {"d": 2}}, "e": [3]})
+    {'a.b': 1, 'a.c.d': 2, 'e': [3]}
+    """
+    flat = {}
+    for key, val in doc.items():
+        key = prefix + key
+        if isinstance(val, dict) and val:
+            flat.update(flatten(val, sep, key + sep))
+        else:
+            flat[key] = val
+    return flat
+
+
+def open_output(path: Pathlike, binary: bool = False):
+    """Open for writing with a large buffer, compressed by file extension"""
+    path = str(path)
+    mode = "wb" if binary else "wt"
+    encoding = None if binary else "utf-8"
+    newline = None if binary else ""
+    for ext, mod in [(".gz", gzip), (".bz2", bz2), (".xz", lzma)]:
+        if path.endswith(ext):
+            # buffer before the compressor, which is slow on small writes
+            fout = io.BufferedWriter(mod.open(path, "wb"), _buffer_size)
+            if binary:
+                return fout
+            return io.TextIOWrapper(fout, encoding=encoding, newline=newline)
+    return open(path, mode, buffering=_buffer_size, encoding=encoding, newline=newline)
+
+
+def _to_scalar(val):
+    if val is None or isinstance(val, (str, int, float, bool)):
+        return val
+    if isinstance(val, (ObjectId, datetime.datetime)):
+        return str(val)
+    return json_util.dumps(val)
+
+
+def _prepare(records: Iterable[dict], flat: bool) -> Iterator[dict]:
+    if not flat:
+        return iter(records)
+    return (flatten(r) for r in records)
+
+
+def _get_header(sample: list[dict]) -> list[str]:
+    """Take the union of fields of records, in order of appearance"""
+    fields = {}
+    for rec in sample:
+        fields.update(dict.fromkeys(rec))
+    return list(fields)
+
+
+def _sample_header(records: Iterator[dict], sample_size: int):
+    sample = list(itertools.islice(records, sample_size))
+    return _get_header(sample), itertools.chain(sample, records)
+
+
+def export_csv(
+    records: Iterable[dict],
+    path: Pathlike,
+    fields: list[str] = None,
+    sample_size: int = 1000,
+    flat: bool = True,
+) -> int:
+    """Write records (e.g. a cursor) to a CSV file in one pass
+
+    Without `fields`, the header is taken from the first `sample_size`
+    records; fields appearing only later are dropped.
+    Returns the number of records written.
+    """
+    records = _prepare(records, flat)
+    if fields is None:
+        fields, records = _sample_header(records, sample_size)
+    count = 0
+    with open_output(path) as fout:
+        writer = csv.writer(fout)
+        writer.writerow(fields)
+        for rec in records:
+            writer.writerow([_to_scalar(rec.get(k, "")) for k in fields])
+            count += 1
+    _logger.info("exported %s records to %s", count, path)
+    return count
+
+
+def export_jsonl(records: Iterable[dict], path: Pathlike, flat: bool = False) -> int:
+    """Write records to a JSON Lines file of extended JSON, in one pass"""
+    count = 0
+    with open_output(path) as fout:
+        for rec in _prepare(records, flat):
+            fout.write(json_util.dumps(rec))
+            fout.write("\n")
+            count += 1
+    _logger.info("exported %s records to %s", count, path)
+    return count
+
+
+def _infer_arrow_type(values: list):
+    import pyarrow as pa
+
+    pytypes = {type(v) for v in values if v is not None}
+    if pytypes == {bool}:
+        return pa.bool_()
+    if pytypes == {int}:
+        return pa.int64()
+    if pytypes and pytypes <= {int, float}:
+        return pa.float64()
+    if pytypes == {datetime.datetime}:
+        return pa.timestamp("ms")
+    # also for ObjectId, mixed types and all-null columns
+    return pa.string()
+
+
+def infer_arrow_schema(records: list[dict], fields: list[str] = None):
+    """Infer a pyarrow.Schema with native column types from sample records"""
+    import pyarrow as pa
+
+    if fields is None:
+        fields = _get_header(records)
+    columns = [(k, _infer_arrow_type([r.get(k) for r in records])) for k in fields]
+    return pa.schema(columns)
+
+
+def _to_arrow_value(val, type_):
+    """Returns a value fitting the Arrow type, or raises TypeError"""
+    import pyarrow as pa
+
+    if val is None:
+        return
+    if pa.types.is_string(type_):
+        return val if isinstance(val, str) else str(_to_scalar(val))
+    if pa.types.is_boolean(type_):
+        ok = isinstance(val, bool)
+    elif pa.types.is_integer(type_):
+        ok = type(val) is int
+    elif pa.types.is_floating(type_):
+        ok = type(val) in (int, float)
+        val = float(val) if ok else val
+    elif pa.types.is_timestamp(type_):
+        ok = isinstance(val, datetime.datetime)
+    else:
+        ok = True
+    if not ok:
+        raise TypeError(f"{type(val).__name__} value in a {type_} column")
+    return val
+
+
+def export_parquet(
+    records: Iterable[dict],
+    path: Pathlike,
+    fields: list[str] = None,
+    sample_size: int = 1000,
+    batch_size: int = 10000,
+    compression: str = "zstd",
+    schema=None,
+) -> int:
+    """Write records to a Parquet file, one row group per batch
+
+    Requires pyarrow. Nested fields are flattened. Unless a pyarrow.Schema
+    is given, column types are inferred from the first `sample_size`
+    records; values not fitting their column type are written as null.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    records = _prepare(records, True)
+    if schema is None:
+        sample = list(itertools.islice(records, sample_size))
+        schema = infer_arrow_schema(sample, fields)
+        records = itertools.chain(sample, records)
+    count = mismatches = 0
+    with pq.ParquetWriter(str(path), schema, compression=compression) as writer:
+        for chunk in iter_chunks(records, batch_size):
+            columns = []
+            for field in schema:
+                column = []
+                for rec in chunk:
+                    try:
+                        column.append(_to_arrow_value(rec.get(field.name), field.type))
+                    except TypeError:
+                        column.append(None)
+                        mismatches += 1
+                columns.append(column)
+            writer.write_table(pa.table(columns, schema=schema))
+            count += len(chunk)
+    if mismatches:
+        _logger.warning("wrote %s mismatching values as null to %s", mismatches, path)
+    _logger.info("exported %s records to %s", count, path)
+    return count
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 # coding: utf-8
 from __future__ import annotations
-
-
 import datetime
+import logging
+import random
+import threading
+import time
+import uuid
 
 from pymongo.collection import Collection, ReturnDocument
 from pymongo.errors import DuplicateKeyError
 
+_logger = logging.getLogger(__name__)
+
 
 class SerialNumber:
     __slots__ = ["prefix", "number", "length"]
@@ -32,6 +37,83 @@ class SerialNumber:
         return self.prefix + str(self.number).zfill(self.length)
 
 
+class SerialNumberAllocator:
+    """Allocate serial numbers block by block (the hi/lo algorithm)
+
+    Each round trip reserves `block_size` numbers with one `$inc`;
+    numbers are then handed out from memory. A background thread
+    reserves the next block when `refill_at` numbers are left.
+
+    Guarantees: numbers are unique across processes, and monotonically
+    increasing within a process. Across processes they interleave, and
+    numbers of a block not used before exit are lost, leaving gaps.
+
+    Shares documents with `SerialNumber`, so both may be used on the
+    same prefix.
+    """
+
+    @staticmethod
+    def _get_collection() -> Collection:
+        raise NotImplementedError
+
+    def __init__(self, prefix="ID", length=6, block_size=1000, refill_at=None):
+        self.prefix = prefix
+        self.length = length
+        self.block_size = block_size
+        if refill_at is None:
+            refill_at = block_size // 5
+        self.refill_at = refill_at
+        self.coll = self._get_collection()
+        self._lock = threading.Lock()
+        self._current = iter(())
+        self._remaining = 0
+        self._next_block = None
+        self._refilling = None
+
+    def _reserve(self) -> range:
+        doc = self.coll.find_one_and_update(
+            {"_id": self.prefix},
+            {"$inc": {"i": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        stop = doc["i"] + 1
+        return range(stop - self.block_size, stop)
+
+    def _refill(self):
+        self._next_block = self._reserve()
+
+    def _start_refilling(self):
+        if self._refilling is not None or self._next_block is not None:
+            return
+        self._refilling = threading.Thread(target=self._refill, daemon=True)
+        self._refilling.start()
+
+    def _switch_block(self):
+        if self._refilling is not None:
+            self._refilling.join()
+            self._refilling = None
+        block = self._next_block or self._reserve()
+        self._next_block = None
+        self._current = iter(block)
+        self._remaining = len(block)
+
+    def next_number(self) -> int:
+        with self._lock:
+            if not self._remaining:
+                self._switch_block()
+            self._remaining -= 1
+            if self._remaining <= self.refill_at:
+                self._start_refilling()
+            return next(self._current)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return self.prefix + str(self.next_number()).zfill(self.length)
+
+
 class NamedLock(object):
     @staticmethod
     def _get_collection() -> Collection:
@@ -55,3 +137,129 @@ class NamedLock(object):
 
     def release(self):
         self.coll.delete_one({"_id": self.name})
+
+
+class LeaseLock:
+    """A named lock with owner tokens and renewable leases
+
+    Usage:
+        with LeaseLock("nightly-job", ttl=30, renew=True, timeout=60):
+            ...
+
+    An expired lock is taken over with a conditional update, instead of
+    deleting expired locks collection-wide. Call `ensure_index()` once
+    to let a TTL index clean up abandoned locks.
+    """
+
+    @staticmethod
+    def _get_collection() -> Collection:
+        raise NotImplementedError
+
+    def __init__(
+        self, name: str, ttl: float = 12, renew: bool = False, timeout: float = None
+    ):
+        self.name = name
+        self.coll = self._get_collection()
+        self.ttl = ttl
+        self.renew = renew
+        # for the context manager
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        self.lost = threading.Event()
+        self._renewing = None
+        self._stop_renewing = threading.Event()
+
+    def ensure_index(self):
+        self.coll.create_index("expire_at", expireAfterSeconds=0)
+
+    def _get_expire_at(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return now, now + datetime.timedelta(seconds=self.ttl)
+
+    def try_acquire(self) -> bool:
+        now, expire_at = self._get_expire_at()
+        filtr = {
+            "_id": self.name,
+            "$or": [{"expire_at": {"$lt": now}}, {"owner": self.token}],
+        }
+        update = {"$set": {"owner": self.token, "expire_at": expire_at}}
+        try:
+            # no match and no expired lock: the upsert hits a duplicate _id
+            self.coll.update_one(filtr, update, upsert=True)
+        except DuplicateKeyError:
+            return False
+        self.lost.clear()
+        if self.renew:
+            self._start_renewing()
+        return True
+
+    def acquire(self, blocking=True, timeout: float = None) -> bool:
+        """Retry with jittered exponential backoff until `timeout`"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            if self.try_acquire():
+                return True
+            if not blocking:
+                return False
+            interval = random.uniform(0, delay)
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                interval = min(interval, left)
+            time.sleep(interval)
+            delay = min(delay * 2, 2.0)
+
+    def extend(self) -> bool:
+        _, expire_at = self._get_expire_at()
+        ur = self.coll.update_one(
+            {"_id": self.name, "owner": self.token},
+            {"$set": {"expire_at": expire_at}},
+        )
+        return bool(ur.matched_count)
+
+    def _renew_forever(self):
+        last_renewed = time.monotonic()
+        while not self._stop_renewing.wait(self.ttl / 3):
+            # noinspection PyBroadException
+            try:
+                renewed = self.extend()
+            except Exception:
+                _logger.warning("failed to renew lock %r", self.name, exc_info=True)
+                # past the ttl, another owner may have taken the lock
+                if time.monotonic() - last_renewed >= self.ttl:
+                    _logger.warning("lost lock %r", self.name)
+                    self.lost.set()
+                    return
+                continue
+            last_renewed = time.monotonic()
+            if not renewed:
+                _logger.warning("lost lock %r", self.name)
+                self.lost.set()
+                return
+
+    def _start_renewing(self):
+        if self._renewing is not None and self._renewing.is_alive():
+            return
+        self._stop_renewing.clear()
+        self._renewing = threading.Thread(target=self._renew_forever, daemon=True)
+        self._renewing.start()
+
+    def release(self) -> bool:
+        """Release only if held by this owner"""
+        self._stop_renewing.set()
+        if self._renewing is not None:
+            # else a quick re-acquire may find the old thread still alive
+            self._renewing.join()
+            self._renewing = None
+        dr = self.coll.delete_one({"_id": self.name, "owner": self.token})
+        return bool(dr.deleted_count)
+
+    def __enter__(self):
+        if not self.acquire(timeout=self.timeout):
+            raise TimeoutError(f"cannot acquire lock {self.name!r}")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -2,13 +2,31 @@
 # coding: utf-8
 from __future__ import annotations
 
-from typing import Union
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Protocol, Union
 
+from pymongo import UpdateOne
 from pymongo.collection import Collection
 
+from joker.mongodb.batch import iter_chunks
+
+_logger = logging.getLogger(__name__)
+
 _Document = Union[str, int, float, bool, list, dict, None]
 
 
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+
+# marks keys not found in the collection
+MISSING = _Missing()
+
+
 def kv_load(c: Collection, key: str) -> _Document:
     record: Union[dict, None] = c.find_one(
         {"_id": key},
@@ -27,6 +45,40 @@ def kv_save(c: Collection, key: str, value: _Document):
     )
 
 
+def kv_load_many(
+    c: Collection, keys: Iterable[str], missing=MISSING, chunk_size: int = 1000
+) -> dict[str, _Document]:
+    """Load values with one `$in` query per chunk of keys
+
+    Keys not found are mapped to `missing`.
+    """
+    values = {}
+    for chunk in iter_chunks(keys, chunk_size):
+        values.update(dict.fromkeys(chunk, missing))
+        for record in c.find({"_id": {"$in": chunk}}, {"value": True}):
+            values[record["_id"]] = record.get("value")
+    return values
+
+
+def kv_save_many(c: Collection, mapping: dict[str, _Document], chunk_size: int = 1000):
+    """Save values with one unordered `bulk_write` of upserts per chunk"""
+    results = []
+    for chunk in iter_chunks(mapping.items(), chunk_size):
+        ops = [
+            UpdateOne({"_id": key}, {"$set": {"value": value}}, upsert=True)
+            for key, value in chunk
+        ]
+        results.append(c.bulk_write(ops, ordered=False))
+    return results
+
+
+# e.g. a KVStore; saving None clears a key
+class _CheckpointStore(Protocol):
+    def load(self, key: str): ...
+
+    def save(self, key: str, value): ...
+
+
 class KVStore:
     def __init__(self, collection: Collection):
         self._collection = collection
@@ -36,3 +88,150 @@ class KVStore:
 
     def save(self, key: str, value: _Document):
         return kv_save(self._collection, key, value)
+
+    def load_many(self, keys: Iterable[str], missing=MISSING) -> dict[str, _Document]:
+        return kv_load_many(self._collection, keys, missing)
+
+    def save_many(self, mapping: dict[str, _Document]):
+        return kv_save_many(self._collection, mapping)
+
+
+class CachedKVStore(KVStore):
+    """A read-through KVStore with an in-process LRU + TTL cache
+
+    Missing keys are cached too, for `negative_ttl` seconds.
+    Call `start_watching()` to evict entries on changes of the backing
+    collection (requires a replica set); `ttl` then only bounds how long
+    stale values may survive a broken change stream.
+
+    Caution: cached values are shared; do not mutate them.
+    """
+
+    def __init__(
+        self,
+        collection: Collection,
+        ttl: float = 60,
+        maxsize: int = 4096,
+        negative_ttl: float = None,
+    ):
+        super().__init__(collection)
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every invalidation; values read before a bump are
+        # not cached, since the invalidation may have come in mid-read
+        self._generation = 0
+        self._watching = threading.Event()
+
+    def _get_cached(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return MISSING, False
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry[1], True
+
+    def _set_cached(self, key: str, value, generation: int):
+        ttl = self.negative_ttl if value is MISSING else self.ttl
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._cache[key] = time.monotonic() + ttl, value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def load(self, key: str) -> _Document:
+        value, found = self._get_cached(key)
+        if not found:
+            generation = self._generation
+            record = self._collection.find_one(
+                {"_id": key},
+                projection={"_id": False, "value": True},
+            )
+            value = MISSING if record is None else record.get("value")
+            self._set_cached(key, value, generation)
+        if value is MISSING:
+            return
+        return value
+
+    def load_many(self, keys: Iterable[str], missing=MISSING) -> dict[str, _Document]:
+        values = {}
+        uncached_keys = []
+        for key in keys:
+            value, found = self._get_cached(key)
+            if found:
+                values[key] = value
+            else:
+                uncached_keys.append(key)
+        if uncached_keys:
+            generation = self._generation
+            loaded = kv_load_many(self._collection, uncached_keys)
+            for key, value in loaded.items():
+                self._set_cached(key, value, generation)
+            values.update(loaded)
+        if missing is not MISSING:
+            values = {k: missing if v is MISSING else v for k, v in values.items()}
+        return values
+
+    def save(self, key: str, value: _Document):
+        result = super().save(key, value)
+        self.invalidate(key)
+        return result
+
+    def save_many(self, mapping: dict[str, _Document]):
+        results = super().save_many(mapping)
+        for key in mapping:
+            self.invalidate(key)
+        return results
+
+    def invalidate(self, key: str = None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def _watch(self):
+        while self._watching.is_set():
+            # noinspection PyBroadException
+            try:
+                with self._collection.watch() as stream:
+                    # entries cached before the stream was open may be stale
+                    self.invalidate()
+                    # a closed stream (e.g. after an invalidate event)
+                    # returns None at once; reopen it in the outer loop
+                    while self._watching.is_set() and stream.alive:
+                        event = stream.try_next()
+                        if event is None:
+                            continue
+                        try:
+                            self.invalidate(event["documentKey"]["_id"])
+                        except KeyError:
+                            # drop, rename, invalidate, etc.
+                            self.invalidate()
+            except Exception:
+                _logger.warning("change stream of KVStore broke", exc_info=True)
+                self.invalidate()
+                time.sleep(1)
+
+    def start_watching(self):
+        if self._watching.is_set():
+            return
+        self._watching.set()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def stop_watching(self):
+        self._watching.clear()
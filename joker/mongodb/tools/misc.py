@@ -9,16 +9,19 @@ import logging
 import sys
 import traceback
 from collections import defaultdict
-from typing import Union
+from typing import Sequence, Union
 
 import pymongo.errors
 from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
 from pymongo.collection import Collection
 from pymongo.cursor import Cursor
 from pymongo.database import Database
 from volkanic.utils import printerr
 
 from joker.mongodb import utils
+from joker.mongodb.batch import iter_chunks
+from joker.mongodb.tools.copying import insert_ignoring_duplicates
 
 _logger = logging.getLogger(__name__)
 
@@ -52,6 +55,7 @@ def patch_mongo_for_debug(wrapper_func=None):
 
 
 def gridfs_copy(source_fs, target_fs, _id):
+    # for many files, use copying.GridFSCopier
     if isinstance(_id, str):
         _id = ObjectId(_id)
     print('copying gridfs file:', _id)
@@ -64,6 +68,9 @@ def gridfs_copy(source_fs, target_fs, _id):
 
 
 def export_records_to_csv(records, outpath):
+    # for large results, use exporting.export_csv() which runs in one pass
+    if not isinstance(records, list):
+        records = list(records)
     fields = set()
     for rec in records:
         fields.update(rec)
@@ -99,10 +106,16 @@ def copy_one(source_coll, target_coll, filtr: dict, updates: dict = None, **kwar
 
 
 def copy_many(source_coll, target_coll, filtr: dict, updates: dict = None, **kwargs):
-    for record in source_coll.find(filtr, **kwargs):
+    # for large collections, use copying.CollectionCopier
+    copied = dup_count = 0
+    for chunk in iter_chunks(source_coll.find(filtr, **kwargs), 1000):
         if updates:
-            record.update(updates)
-        _insert(target_coll, record)
+            for record in chunk:
+                record.update(updates)
+        inserted, dups = insert_ignoring_duplicates(target_coll, chunk)
+        copied += inserted
+        dup_count += dups
+    printerr('OK:', target_coll, copied, 'Dup:', dup_count)
 
 
 def find_field_names(coll: Collection, retry: int = 10):
@@ -129,6 +142,21 @@ class DatabaseWrapper:
         return utils.print_mongo_storage_sizes(self.db)
 
 
+_UniqueKey = Union[str, Sequence[str]]
+
+
+def _get_uk_filter(record: dict, uk: _UniqueKey) -> dict:
+    if isinstance(uk, str):
+        return {uk: record.get(uk)}
+    return {k: record.get(k) for k in uk}
+
+
+def _get_uk_value(record: dict, uk: _UniqueKey):
+    if isinstance(uk, str):
+        return record.get(uk)
+    return tuple(record.get(k) for k in uk)
+
+
 class CollectionWrapper:
     def __init__(self, coll: Collection, filtr=None, projection=None):
         self.coll = coll
@@ -184,8 +212,7 @@ class CollectionWrapper:
         :param uk: unique key
         """
         for rec in records:
-            uk_val = rec.get(uk)
-            self.coll.replace_one({uk: uk_val}, rec)
+            self.coll.replace_one(_get_uk_filter(rec, uk), rec)
 
     def _update(self, records, uk='_id'):
         """
@@ -193,8 +220,7 @@ class CollectionWrapper:
         :param uk: unique key
         """
         for rec in records:
-            uk_val = rec.get(uk)
-            self.coll.update_one({uk: uk_val}, {'$set': rec})
+            self.coll.update_one(_get_uk_filter(rec, uk), {'$set': rec})
 
     def _insert(self, records):
         if records:
@@ -202,55 +228,91 @@ class CollectionWrapper:
 
     @staticmethod
     def _check_for_uniqueness(records, uk):
-        vals = [r.get(uk) for r in records]
+        vals = [_get_uk_value(r, uk) for r in records]
         uniq_vals = set(vals)
         if len(vals) != len(uniq_vals):
             raise ValueError('records contain duplicating keys')
 
-    def upsert_with_index(self, records, uk='_id', replace=False):
+    @staticmethod
+    def _build_upsert_op(record: dict, uk: _UniqueKey, replace: bool):
+        filtr = _get_uk_filter(record, uk)
+        if replace:
+            return ReplaceOne(filtr, record, upsert=True)
+        return UpdateOne(filtr, {'$set': record}, upsert=True)
+
+    def upsert(self, records, uk: _UniqueKey = '_id', replace=False, chunk_size=1000):
+        """Batch insert or update with one `bulk_write` per chunk
+        Caution:
+        - repeats in records lead to unpredictable results
+        - not atomic
+        :param records: an iterable of dicts
+        :param uk: unique key, or a list of keys for a compound unique key
+        :param replace: use ReplaceOne instead of UpdateOne
+        :param chunk_size: max number of operations per bulk_write
+        :return: a dict of aggregated counts
+        """
+        counts = {'inserted': 0, 'matched': 0, 'modified': 0}
+        for chunk in iter_chunks(records, chunk_size):
+            ops = [self._build_upsert_op(r, uk, replace) for r in chunk]
+            result = self.coll.bulk_write(ops, ordered=False)
+            counts['inserted'] += result.upserted_count
+            counts['matched'] += result.matched_count
+            counts['modified'] += result.modified_count
+        return counts
+
+    def upsert_with_index(self, records, uk: _UniqueKey = '_id', replace=False):
         """Batch insert or update
-        requires single-field unique index on `uk`
+        requires a unique index on `uk` (single-field or compound)
         Similar to `INESRT ... ON DUPLICATE KEY UPDATE ...` in MySQL
         Caution:
         - repeats in records lead to unpredictable results
         - not atomic
         :param records: a list of dicts
         :type records: list
-        :param uk: unique key
-        :type uk: str
+        :param uk: unique key, or a list of keys for a compound unique key
+        :type uk: str | list[str]
         :param replace: use coll.replace instead of collection.update
         :type replace: bool
+        :return: a dict of aggregated counts
         """
-        if not records:
-            return
-        dup_records = []
-        try:
-            self._insert(records)
-        except pymongo.errors.BulkWriteError as exc:
-            other_errors = []
-            for err in exc.details['writeErrors']:
-                if err['code'] == 11000:
-                    dup_records.append(err['op'])
-                else:
-                    other_errors.append(err)
-            if other_errors or exc.details['writeConcernErrors']:
-                exc.details['writeErrors'] = other_errors
-                raise exc
-        if replace:
-            self._replace(records, uk=uk)
-        else:
-            self._update(records, uk=uk)
+        return self.upsert(records, uk=uk, replace=replace)
 
-    def upsert_without_index(self, records, uk='_id', replace=False):
+    def find_existing_keys(self, records, uk: _UniqueKey = '_id', chunk_size=1000) -> set:
+        """Look up which unique key values of `records` are already stored
+        Only the incoming keys are queried, in chunks of `$in` (or `$or`
+        for compound keys), projected onto `uk` only, so that an index on
+        `uk` covers the query.
+        :param records: a list of dicts
+        :param uk: unique key, or a list of keys for a compound unique key
+        :param chunk_size: max number of keys per query
+        :return: a set of values, tuples for compound keys
+        """
+        keys = [uk] if isinstance(uk, str) else list(uk)
+        projection = dict.fromkeys(keys, True)
+        if '_id' not in projection:
+            projection['_id'] = False
+        existing_vals = set()
+        for chunk in iter_chunks(records, chunk_size):
+            if isinstance(uk, str):
+                vals = list({_get_uk_value(r, uk) for r in chunk})
+                filtr = {uk: {'$in': vals}}
+            else:
+                filtr = {'$or': [_get_uk_filter(r, uk) for r in chunk]}
+            for doc in self.coll.find(filtr, projection):
+                existing_vals.add(_get_uk_value(doc, uk))
+        return existing_vals
+
+    def upsert_without_index(self, records, uk: _UniqueKey = '_id', replace=False):
         """Batch insert or update
-        single-field unique index on `uk` is not required
+        unique index on `uk` is not required, but a (non-unique) index
+        on `uk` keeps the existence check cheap
         Caution:
         - repeats in records lead to unpredictable results
         - not atomic
         :param records: a list of dicts
         :type records: list
-        :param uk: unique key
-        :type uk: str
+        :param uk: unique key, or a list of keys for a compound unique key
+        :type uk: str | list[str]
         :param replace: use coll.replace instead of collection.update
         :type replace: bool
         """
@@ -259,9 +321,9 @@ class CollectionWrapper:
         self._check_for_uniqueness(records, uk)
         insert_records = []
         update_records = []
-        existing_vals = {r.get(uk) for r in self.coll.find({}, ['uk'])}
+        existing_vals = self.find_existing_keys(records, uk)
         for rec in records:
-            uk_val = rec.get(uk)
+            uk_val = _get_uk_value(rec, uk)
             if uk_val in existing_vals:
                 update_records.append(rec)
             else:
@@ -3,18 +3,23 @@
 from __future__ import annotations
 
 import logging
+import queue
+import re
 import threading
 import time
 import traceback
 from collections import UserDict
 from collections import defaultdict
-from typing import Callable
+from typing import Callable, Union
 
 import pymongo
+import pymongo.errors
 from bson import Timestamp, json_util, ObjectId
 from pymongo import MongoClient
 from pymongo.database import Database
 
+from joker.mongodb.tools.kvstore import _CheckpointStore
+
 _logger = logging.getLogger(__name__)
 
 
@@ -67,53 +72,74 @@ class OplogRecord(UserDict):
 class OplogTailer(object):
     _ns_exclude = {}
     _db_exclude = {"config", "local", "admin"}
+    _max_await_time_ms = 1000
+    _dead_cursor_interval = 0.5
     record_cls = OplogRecord
 
     def __init__(
         self,
         upstream_client: MongoClient,
-        ts: Timestamp,
+        ts: Union[Timestamp, int] = None,
         ns_pattern: str = None,
         ns_exclude: str = None,
+        checkpoint_store: _CheckpointStore = None,
+        checkpoint_key: str = "oplog_tailer.ts",
     ):
         """
         Args:
             upstream_client:
-            ts: starting timestamp (seconds since epoch), e.g. 1642477123
+            ts: starting timestamp (seconds since epoch), e.g. 1642477123;
+                if None, resume from the checkpoint, or else start from now
             ns_pattern: regex
             ns_exclude: regex
+            checkpoint_store: where the last applied ts is saved,
+                e.g. a KVStore, or anything with load(key) and save(key, value)
+            checkpoint_key: key of the ts in checkpoint_store
         """
         db = upstream_client.get_database("local")
         self.oplog_coll = db.get_collection("oplog.rs")
+        self.checkpoint_store = checkpoint_store
+        self.checkpoint_key = checkpoint_key
+        if ts is None and checkpoint_store is not None:
+            ts = checkpoint_store.load(checkpoint_key)
+        if ts is None:
+            ts = int(time.time())
+        if isinstance(ts, int):
+            ts = Timestamp(ts, 0)
         self.ts = ts
         self.ns_pattern = ns_pattern
         self.ns_exclude = ns_exclude
+        self._await_time_ms = self._max_await_time_ms
         self._cursor = self._get_cursor()
 
-    def _get_where_clause(self):
-        tests = ['this.op != "n"']
-        if self.ns_pattern is not None:
-            tests.append("this.ns.match(/{}/)".format(self.ns_pattern))
-            # tests.append(f'this.ns.match(/{self.ns_pattern}/)')
+    def _get_filter(self) -> dict:
+        # native operators instead of a JavaScript $where clause
+        excl_regexes = [r"^(?:{})\.".format("|".join(self._db_exclude))]
         if self.ns_exclude is not None:
-            tests.append("!this.ns.match(/{}/)".format(self.ns_exclude))
-            # tests.append(f'!this.ns.match(/{self.ns_exclude}/)')
-        return "&&".join(tests)
+            excl_regexes.append(self.ns_exclude)
+        ns_cond = {
+            "$not": re.compile("|".join(excl_regexes)),
+        }
+        if self._ns_exclude:
+            ns_cond["$nin"] = list(self._ns_exclude)
+        if self.ns_pattern is not None:
+            ns_cond["$regex"] = self.ns_pattern
+        return {
+            "ts": {"$gt": self.ts},
+            "op": {"$ne": "n"},
+            "ns": ns_cond,
+        }
 
     def _get_cursor(self):
-        filtr = {"ts": {"$gt": self.ts}}
+        filtr = self._get_filter()
         # https://pymongo.readthedocs.io/en/stable/examples/tailable.html
-        # TODO: consider using $expr for mongo >= 3.6
         _logger.info("OplogTailer._get_cursor, filtr=%s", filtr)
-        cursor = self.oplog_coll.find(
+        return self.oplog_coll.find(
             filtr,
             oplog_replay=True,
             cursor_type=pymongo.CursorType.TAILABLE_AWAIT,
+            max_await_time_ms=self._await_time_ms,
         )
-        where_clause = self._get_where_clause()
-        if where_clause:
-            cursor = cursor.where(where_clause)
-        return cursor
 
     def _reset_cursor(self):
         self._cursor.close()
@@ -131,10 +157,23 @@ class OplogTailer(object):
         return True
 
     def _fetch_next(self):
+        # the server holds an awaitable cursor for up to max_await_time_ms
+        # before giving up, so no sleeping is needed while it is alive
         try:
             return self._cursor.next()
-        except (StopIteration, ConnectionResetError):
-            self._reset_cursor()
+        except StopIteration:
+            if self._cursor.alive:
+                return
+        except (ConnectionResetError, pymongo.errors.AutoReconnect):
+            pass
+        time.sleep(self._dead_cursor_interval)
+        self._reset_cursor()
+
+    def checkpoint(self):
+        """Save the ts of the last yielded record"""
+        if self.checkpoint_store is None:
+            return
+        self.checkpoint_store.save(self.checkpoint_key, self.ts)
 
     def __iter__(self):
         return self
@@ -143,18 +182,53 @@ class OplogTailer(object):
         while True:
             doc = self._fetch_next()
             if doc is None:
-                time.sleep(1)
                 continue
             if not self._check_ns(doc):
                 continue
             self.ts = doc.get("ts")
             return self.record_cls(doc)
 
+    def _next_batch(self, size: int, timeout: float) -> list:
+        batch = []
+        deadline = None
+        while len(batch) < size:
+            doc = self._fetch_next()
+            if doc is not None and self._check_ns(doc):
+                self.ts = doc.get("ts")
+                batch.append(self.record_cls(doc))
+                if deadline is None:
+                    deadline = time.monotonic() + timeout
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return batch
+
+    def iter_batches(self, size: int = 100, timeout: float = 0.5):
+        """Yield lists of records, and checkpoint when a batch is done
+
+        A batch is closed when it has `size` records, or `timeout` seconds
+        after its first record arrived; the server-side await of each
+        fetch is capped at `timeout`, so a batch is late by at most
+        that much. The ts of a batch is
+        saved when the next batch is requested, i.e. after the caller
+        has applied it; delivery is thus at-least-once after a restart.
+        """
+        await_time_ms = max(1, min(self._max_await_time_ms, int(timeout * 1000)))
+        if await_time_ms != self._await_time_ms:
+            self._await_time_ms = await_time_ms
+            self._reset_cursor()
+        while True:
+            yield self._next_batch(size, timeout)
+            self.checkpoint()
+
 
 class ChangeStreamRegistry:
     def __init__(self, db: Database):
         self.db = db
         self.handlers = defaultdict(list)
+        self._queues: list[queue.Queue] = []
+        self._dispatched = 0
+        self._processed: list[int] = []
+        self._stopping = threading.Event()
 
     @staticmethod
     def apply(handler: Callable, coll_name: str, event: dict):
@@ -193,3 +267,68 @@ class ChangeStreamRegistry:
             threads.append(thr)
         for thr in threads:
             thr.join()
+
+    def _work(self, idx: int):
+        q = self._queues[idx]
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            coll_name, event = item
+            for handler in self.handlers.get(coll_name, []):
+                self.apply(handler, coll_name, event)
+            self._processed[idx] += 1
+
+    def _dispatch(self, event: dict):
+        coll_name = event.get("ns", {}).get("coll")
+        # events of the same document always go to the same worker
+        key = coll_name, str(event.get("documentKey"))
+        idx = hash(key) % len(self._queues)
+        # blocks when the worker falls behind -- backpressure
+        self._queues[idx].put((coll_name, event))
+        self._dispatched += 1
+
+    def get_metrics(self) -> dict:
+        return {
+            "dispatched": self._dispatched,
+            "processed": sum(self._processed),
+            "queue_depths": [q.qsize() for q in self._queues],
+        }
+
+    def stop(self):
+        self._stopping.set()
+
+    def execute_multiplexed(self, workers: int = 8, queue_size: int = 1000):
+        """Watch all registered collections with one change stream
+
+        Events are dispatched to a pool of `workers` threads, each with
+        a queue of at most `queue_size` events. Events of the same
+        document are handled in order; a slow handler only holds up
+        the documents hashed to its worker. The stream is reopened when
+        the server closes it, e.g. on an invalidate event.
+        """
+        self._stopping.clear()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processed = [0] * workers
+        threads = []
+        for idx in range(workers):
+            thr = threading.Thread(target=self._work, args=(idx,), daemon=True)
+            thr.start()
+            threads.append(thr)
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.handlers)}}}]
+        resume_token = None
+        try:
+            while not self._stopping.is_set():
+                with self.db.watch(pipeline, start_after=resume_token) as stream:
+                    # a closed stream (e.g. after dropDatabase) returns None
+                    # at once; reopen it after the last event seen
+                    while not self._stopping.is_set() and stream.alive:
+                        event = stream.try_next()
+                        if event is not None:
+                            self._dispatch(event)
+                    resume_token = stream.resume_token
+        finally:
+            for q in self._queues:
+                q.put(None)
+            for thr in threads:
+                thr.join()
@@ -2,9 +2,17 @@
 # coding: utf-8
 from __future__ import annotations
 
+import base64
 import dataclasses
+import threading
+import time
+from collections import OrderedDict
 from typing import TypedDict, Iterable
 
+import bson
+from bson import json_util
+from pymongo.collection import Collection
+
 
 class _CountDict(TypedDict):
     total: int
@@ -15,6 +23,30 @@ class RawResultDict(TypedDict):
     counts: list[_CountDict]
 
 
+def encode_keyset_token(values: list) -> str:
+    """Encode sort key values of the last item into an opaque token"""
+    raw = bson.encode({"v": values})
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_keyset_token(token: str) -> list:
+    padding = "=" * (-len(token) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(token + padding)
+        return bson.decode(raw)["v"]
+    except Exception as exc:
+        raise ValueError(f"invalid keyset token: {token!r}") from exc
+
+
+def _get_field_value(doc: dict, path: str):
+    val = doc
+    for key in path.split("."):
+        if not isinstance(val, dict):
+            return
+        val = val.get(key)
+    return val
+
+
 @dataclasses.dataclass
 class QueryParams:
     skip: int = 0
@@ -22,34 +54,85 @@ class QueryParams:
     sort: str = "_id"
     order: int = -1
     keyword: str = None
+    # keyset (seek) pagination
+    after: str = None
+    secondary_sorts: list[tuple[str, int]] = None
 
-    def get_facet_stage(self):
-        return {
-            "$facet": {
-                "documents": [
-                    {"$skip": self.skip},
-                    {"$limit": self.limit},
-                ],
-                # total count of documents
-                "counts": [{"$count": "total"}],
-            }
+    def get_facet_stage(self, with_counts: bool = True):
+        facet = {
+            "documents": [
+                {"$skip": self.skip},
+                {"$limit": self.limit},
+            ],
         }
+        if with_counts:
+            # total count of documents
+            facet["counts"] = [{"$count": "total"}]
+        return {"$facet": facet}
 
     def get_sort_stage(self):
         return {"$sort": {self.sort: self.order}}
 
-
-    def get_pagination_pipeline(self):
+    def get_pagination_pipeline(self, with_counts: bool = True):
         return [
             self.get_sort_stage(),
-            self.get_facet_stage(),
+            self.get_facet_stage(with_counts),
         ]
 
+    def get_keyset_sort_keys(self) -> list[tuple[str, int]]:
+        """Sort keys with `_id` appended as the tie-breaker"""
+        keys = [(self.sort, self.order)]
+        keys.extend(self.secondary_sorts or [])
+        if all(k != "_id" for k, _ in keys):
+            keys.append(("_id", keys[-1][1]))
+        return keys
+
+    def get_keyset_filter(self) -> dict:
+        """
+        For sort keys (a, 1), (b, -1) and values [x, y], returns
+        {"$or": [{"a": {"$gt": x}}, {"a": {"$eq": x}, "b": {"$lt": y}}]}
+
+        Values come from a client-supplied token; `$eq` keeps them literal.
+        """
+        if not self.after:
+            return {}
+        keys = self.get_keyset_sort_keys()
+        values = decode_keyset_token(self.after)
+        if len(values) != len(keys):
+            raise ValueError("keyset token does not match sort keys")
+        branches = []
+        for i, (key, order) in enumerate(keys):
+            branch = {k: {"$eq": v} for (k, _), v in zip(keys[:i], values)}
+            branch[key] = {"$gt" if order > 0 else "$lt": values[i]}
+            branches.append(branch)
+        if len(branches) == 1:
+            return branches[0]
+        return {"$or": branches}
+
+    def get_keyset_pipeline(self):
+        """
+        Deep pages cost as much as the first one, provided that an index
+        matches the sort keys. Sort fields should not be null or missing.
+        One extra document is fetched to tell if there is a next page.
+        """
+        stages = []
+        filtr = self.get_keyset_filter()
+        if filtr:
+            stages.append({"$match": filtr})
+        stages.append({"$sort": dict(self.get_keyset_sort_keys())})
+        stages.append({"$limit": self.limit + 1})
+        return stages
+
+    def get_keyset_token(self, doc: dict) -> str:
+        keys = self.get_keyset_sort_keys()
+        return encode_keyset_token([_get_field_value(doc, k) for k, _ in keys])
+
 
 @dataclasses.dataclass
 class PaginatedResult:
     items: list[dict]
-    total: int
+    total: int | None
+    next_token: str = None
 
     @classmethod
     def from_raw(
@@ -59,9 +142,133 @@ class PaginatedResult:
         # from typing import Self
         # from_raw(cls: type[Self], raw: Iterable[RawResultDict]) -> Self:
         result: RawResultDict = list(raw)[0]
-        counts = result["counts"]
+        counts = result.get("counts")
         total = counts[0]["total"] if counts else 0
         return PaginatedResult(items=result["documents"], total=total)
 
+    @classmethod
+    def from_keyset(
+        cls: type[PaginatedResult],
+        docs: Iterable[dict],
+        params: QueryParams,
+        total: int = None,
+    ) -> PaginatedResult:
+        """Build from the output of `QueryParams.get_keyset_pipeline()`"""
+        items = list(docs)
+        next_token = None
+        if len(items) > params.limit:
+            items = items[: params.limit]
+            next_token = params.get_keyset_token(items[-1])
+        return PaginatedResult(items=items, total=total, next_token=next_token)
+
     def to_dict(self) -> dict:
-        return dataclasses.asdict(self)
+        d = dataclasses.asdict(self)
+        if d["next_token"] is None:
+            d.pop("next_token")
+        return d
+
+
+class TotalCounter:
+    """Strategy of counting the total for a paginated query"""
+
+    def count(self, coll: Collection, filtr: dict) -> int:
+        raise NotImplementedError
+
+
+class ExactCounter(TotalCounter):
+    def count(self, coll: Collection, filtr: dict) -> int:
+        return coll.count_documents(filtr)
+
+
+class EstimatedCounter(TotalCounter):
+    """Use collection metadata for unfiltered queries; exact otherwise"""
+
+    def count(self, coll: Collection, filtr: dict) -> int:
+        if not filtr:
+            return coll.estimated_document_count()
+        return coll.count_documents(filtr)
+
+
+class CappedCounter(TotalCounter):
+    """Stop counting at `cap`; a total equal to `cap` means 'at least'"""
+
+    def __init__(self, cap: int = 10000):
+        self.cap = cap
+
+    def count(self, coll: Collection, filtr: dict) -> int:
+        return coll.count_documents(filtr, limit=self.cap)
+
+
+class CachedCounter(TotalCounter):
+    """Cache totals of another counter, keyed by namespace and filter"""
+
+    def __init__(self, counter: TotalCounter = None, ttl: float = 60, maxsize=1024):
+        self.counter = counter or ExactCounter()
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(coll: Collection, filtr: dict) -> str:
+        # key order of embedded documents is significant in mongo queries,
+        # so only the JSON representation is used, without sorting keys
+        return coll.full_name + " " + json_util.dumps(filtr)
+
+    def _get_cached(self, key: str) -> int | None:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return entry[1]
+
+    def _set_cached(self, key: str, total: int):
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, total)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def count(self, coll: Collection, filtr: dict) -> int:
+        key = self._normalize(coll, filtr)
+        total = self._get_cached(key)
+        if total is None:
+            total = self.counter.count(coll, filtr)
+            self._set_cached(key, total)
+        return total
+
+    def invalidate(self, coll: Collection = None):
+        with self._lock:
+            if coll is None:
+                self._cache.clear()
+                return
+            prefix = coll.full_name + " "
+            for key in [k for k in self._cache if k.startswith(prefix)]:
+                del self._cache[key]
+
+
+def paginate(
+    coll: Collection,
+    filtr: dict,
+    params: QueryParams,
+    counter: TotalCounter = None,
+) -> PaginatedResult:
+    """Run an offset-paginated query
+
+    With `counter` given, the `$count` facet is left out of the pipeline
+    and the total is obtained from the counter instead.
+    """
+    pipeline = [{"$match": filtr}]
+    pipeline.extend(params.get_pagination_pipeline(with_counts=counter is None))
+    result = PaginatedResult.from_raw(coll.aggregate(pipeline))
+    if counter is not None:
+        result.total = counter.count(coll, filtr)
+    return result
+
+
+def paginate_keyset(
+    coll: Collection, filtr: dict, params: QueryParams
+) -> PaginatedResult:
+    pipeline = [{"$match": filtr}]
+    pipeline.extend(params.get_keyset_pipeline())
+    return PaginatedResult.from_keyset(coll.aggregate(pipeline), params)
@@ -2,46 +2,211 @@
 # coding: utf-8
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
+import os
+import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urljoin
 
 import requests
+from pymongo import MongoClient
 
+from joker.mongodb.tools.dumpfiles import DumpDirectory
 from joker.mongodb.utils import Pathlike
 
 _logger = logging.getLogger(__name__)
 
+_chunk_size = 1024 * 1024
 
-def _download(url: str, path: Path) -> None:
+
+def _get_complete_length(resp: requests.Response) -> int | None:
+    # e.g. "Content-Range: bytes */1234" of a 416 response
+    total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def _download(
+    url: str, path: Path, session: requests.Session = None, etag: str = None
+) -> None:
+    """Download to `path`, resuming a partial `<path>.part` with HTTP Range
+
+    A partial file is resumed only if it was downloaded under the same
+    ETag, which is kept in `<path>.etag` and sent as If-Range.
+    """
+    session = session or requests
     path.parent.mkdir(parents=True, exist_ok=True)
-    with requests.get(url, stream=True) as resp:
-        resp.raise_for_status()
-        with open(path, "wb") as fout:
-            for chunk in resp.iter_content(chunk_size=8192):
-                fout.write(chunk)
+    part_path = path.with_name(path.name + ".part")
+    etag_path = path.with_name(path.name + ".etag")
+    offset = 0
+    if etag and part_path.exists() and etag_path.exists():
+        if etag_path.read_text() == etag:
+            offset = part_path.stat().st_size
+    if etag:
+        etag_path.write_text(etag)
+    headers = {"Range": f"bytes={offset}-", "If-Range": etag} if offset else {}
+    with session.get(url, stream=True, headers=headers) as resp:
+        if resp.status_code == 416:
+            if _get_complete_length(resp) != offset:
+                # the partial file does not match the remote file
+                part_path.unlink()
+                return _download(url, path, session, etag)
+            # the partial file is already complete
+        else:
+            resp.raise_for_status()
+            # 200 means the server ignored the Range header or If-Range failed
+            mode = "ab" if resp.status_code == 206 else "wb"
+            with open(part_path, mode) as fout:
+                for chunk in resp.iter_content(chunk_size=_chunk_size):
+                    fout.write(chunk)
+    os.replace(part_path, path)
+    if etag_path.exists():
+        etag_path.unlink()
     _logger.info("downloaded %s", path)
 
 
+def _sha256sum(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(_chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _link_or_copy(src: Path, dst: Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class DownloadCache:
+    """A content-addressed cache of downloaded files
+
+    Files are stored as `objects/<sha256>`; `index.json` maps each URL to
+    the ETag, size and sha256 seen at the last download.
+
+    A cached file is reused if the server reports the same ETag; for a
+    server without ETags, a matching Content-Length is taken as enough,
+    so a remote file rewritten at the same size goes unnoticed.
+    """
+
+    def __init__(self, dir_: Pathlike):
+        self.dir_ = Path(dir_)
+        self._index_path = self.dir_ / "index.json"
+        self._lock = threading.Lock()
+        try:
+            self._index = json.loads(self._index_path.read_text())
+        except (FileNotFoundError, ValueError):
+            self._index = {}
+
+    def _get_object_path(self, sha256: str) -> Path:
+        return self.dir_ / "objects" / sha256
+
+    def _get_part_path(self, url: str) -> Path:
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return self.dir_ / "partial" / name
+
+    @staticmethod
+    def _matches(entry: dict, etag: str, size: int) -> bool:
+        if etag:
+            return entry.get("etag") == etag
+        return size is not None and entry.get("size") == size
+
+    def lookup(self, url: str, etag: str = None, size: int = None) -> Path | None:
+        with self._lock:
+            entry = self._index.get(url)
+        if not entry or not self._matches(entry, etag, size):
+            return
+        path = self._get_object_path(entry["sha256"])
+        if path.exists():
+            return path
+
+    def store(
+        self, url: str, session: requests.Session = None, etag: str = None
+    ) -> Path:
+        part_path = self._get_part_path(url)
+        _download(url, part_path, session, etag)
+        sha256 = _sha256sum(part_path)
+        path = self._get_object_path(sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(part_path, path)
+        return path
+
+    def update_index(self, url: str, path: Path, etag: str = None):
+        entry = {"etag": etag, "size": path.stat().st_size, "sha256": path.name}
+        with self._lock:
+            self._index[url] = entry
+            tmp_path = self._index_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self._index, indent=1))
+            os.replace(tmp_path, self._index_path)
+
+
 class DumpSuite:
-    def __init__(self, dir_: Pathlike, source: str):
+    def __init__(self, dir_: Pathlike, source: str, cache_dir: Pathlike = None):
         self.dir_ = Path(dir_)
         self.source = source
+        if cache_dir is None:
+            cache_dir = Path.home() / ".cache" / "joker-mongodb" / "dumps"
+        self.cache = DownloadCache(cache_dir)
+        self._local = threading.local()
 
-    def fetch(self, db_name: str, collection_name: str):
-        rel_paths = [
+    @property
+    def _session(self) -> requests.Session:
+        # one session, thus one connection pool, per thread
+        try:
+            return self._local.session
+        except AttributeError:
+            self._local.session = requests.Session()
+            return self._local.session
+
+    @staticmethod
+    def _get_rel_paths(db_name: str, collection_name: str) -> list[str]:
+        return [
             f"{db_name}/{collection_name}.bson.gz",
             f"{db_name}/{collection_name}.metadata.json.gz",
         ]
-        for path in rel_paths:
-            url = urljoin(self.source, path)
-            _download(url, self.dir_ / path)
 
-    def batch_fetch(self, names: list[str]):
+    def _fetch_file(self, rel_path: str):
+        url = urljoin(self.source, rel_path)
+        resp = self._session.head(url, allow_redirects=True)
+        if not resp.ok:
+            # e.g. 403 or 405 from a server or presigned URL refusing HEAD;
+            # without validators the cache cannot be trusted, so bypass it
+            _logger.info("HEAD %s returned %s, not cached", url, resp.status_code)
+            _download(url, self.dir_ / rel_path, self._session)
+            return
+        etag = resp.headers.get("ETag")
+        size = resp.headers.get("Content-Length")
+        size = int(size) if size else None
+        path = self.cache.lookup(url, etag, size)
+        if path is None:
+            path = self.cache.store(url, self._session, etag)
+            self.cache.update_index(url, path, etag)
+        else:
+            _logger.info("cache hit %s", url)
+        _link_or_copy(path, self.dir_ / rel_path)
+
+    def fetch(self, db_name: str, collection_name: str):
+        for path in self._get_rel_paths(db_name, collection_name):
+            self._fetch_file(path)
+
+    def batch_fetch(self, names: list[str], workers: int = 8):
+        """Fetch files concurrently; unchanged files come from the cache"""
+        rel_paths = []
         for name in names:
             db_name, collection_name = name.split(".", maxsplit=1)
-            self.fetch(db_name, collection_name)
+            rel_paths.extend(self._get_rel_paths(db_name, collection_name))
+        with ThreadPoolExecutor(workers) as executor:
+            for _ in executor.map(self._fetch_file, rel_paths):
+                pass
 
     def restore(self, host: str = "mongodb", port: int = 27017):
         cmd = [
@@ -53,3 +218,7 @@ class DumpSuite:
             f"--port={port}",
         ]
         subprocess.run(cmd, check=True)
+
+    def restore_in_process(self, client: MongoClient, drop: bool = True) -> dict:
+        """Like restore(), but without the mongorestore executable"""
+        return DumpDirectory(self.dir_).restore(client, drop=drop)
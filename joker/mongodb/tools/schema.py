@@ -4,9 +4,10 @@ from __future__ import annotations
 
 import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable, Type, TypeVar
 
-from bson import ObjectId
+from bson import Binary, Decimal128, Int64, ObjectId
 from pymongo.collection import Collection
 
 
@@ -14,19 +15,30 @@ class MongoFieldSchemator:
     _bsontype_of_pytypes = {
         str: "string",
         dict: "object",
+        list: "array",
         type(None): "null",
         datetime.datetime: "date",
-        int: "long",
+        int: "int",
+        Int64: "long",
+        float: "double",
         bool: "bool",
+        bytes: "binData",
+        Binary: "binData",
+        Decimal128: "decimal",
         ObjectId: "objectId",
     }
 
+    # enum values are collected only for types of few distinct values
+    _enum_bsontypes = {"string", "int", "bool", "null"}
     _max_enum_length = 7
     _max_type_length = 3
 
     def __init__(self):
         self._bsontypes = set()
         self._enum_values = set()
+        # schema of embedded documents and of array items
+        self._object: MongoDocumentSchemator | None = None
+        self._items: MongoFieldSchemator | None = None
 
     @property
     def _enum_enabled(self) -> bool:
@@ -34,24 +46,55 @@ class MongoFieldSchemator:
             return False
         return set not in self._enum_values
 
-    def _add_bsontype(self, val):
-        try:
-            bsontype = self._bsontype_of_pytypes[type(val)]
-        except KeyError:
-            return
-        self._bsontypes.add(bsontype)
+    def _get_bsontype(self, val) -> str | None:
+        # like pymongo, encode int as int32 if it fits, otherwise as int64
+        if type(val) is int and not -(2**31) <= val < 2**31:
+            return "long"
+        return self._bsontype_of_pytypes.get(type(val))
 
-    def _add_enum_value(self, val):
-        if self._enum_enabled:
+    def _disable_enum(self):
+        self._enum_values.add(set)
+
+    def _add_enum_value(self, val, bsontype: str | None):
+        if not self._enum_enabled:
             return
-        try:
+        if bsontype in self._enum_bsontypes:
             self._enum_values.add(val)
-        except TypeError:
-            self._enum_values.add(set)
+        else:
+            self._disable_enum()
+
+    def _add_nested(self, val):
+        if isinstance(val, dict):
+            if self._object is None:
+                self._object = MongoDocumentSchemator()
+            self._object.add(val)
+        elif isinstance(val, list):
+            if self._items is None:
+                self._items = MongoFieldSchemator()
+            for item in val:
+                self._items.add(item)
 
     def add(self, val):
-        self._add_enum_value(val)
-        self._add_bsontype(val)
+        bsontype = self._get_bsontype(val)
+        if bsontype is not None:
+            self._bsontypes.add(bsontype)
+        self._add_enum_value(val, bsontype)
+        self._add_nested(val)
+
+    def merge(self, other: MongoFieldSchemator):
+        self._bsontypes.update(other._bsontypes)
+        if not other._enum_enabled:
+            self._disable_enum()
+        if self._enum_enabled:
+            self._enum_values.update(other._enum_values)
+        if other._object is not None:
+            if self._object is None:
+                self._object = MongoDocumentSchemator()
+            self._object.merge(other._object)
+        if other._items is not None:
+            if self._items is None:
+                self._items = MongoFieldSchemator()
+            self._items.merge(other._items)
 
     @property
     def bsontype(self) -> str | list[str] | None:
@@ -59,7 +102,7 @@ class MongoFieldSchemator:
             return
         if len(self._bsontypes) > self._max_type_length:
             return
-        _bsontypes = list(self._bsontypes)
+        _bsontypes = sorted(self._bsontypes)
         if len(_bsontypes) > 1:
             return _bsontypes
         return _bsontypes[0]
@@ -68,7 +111,11 @@ class MongoFieldSchemator:
     def enum(self) -> list | None:
         if not self._enum_enabled or not self._enum_values:
             return
-        return list(sorted(self._enum_values))
+        try:
+            return list(sorted(self._enum_values))
+        except TypeError:
+            # values of mixed types
+            return list(self._enum_values)
 
     def to_jsonschema_property(self) -> dict:
         """
@@ -80,6 +127,11 @@ class MongoFieldSchemator:
             }
         """
         p = {"bsonType": self.bsontype, "enum": self.enum}
+        if self._object is not None:
+            p["properties"] = self._object.get_properties()
+            p["required"] = self._object.get_required() or None
+        if self._items is not None and self._items._bsontypes:
+            p["items"] = self._items.to_jsonschema_property()
         return {k: v for k, v in p.items() if v is not None}
 
 
@@ -87,12 +139,21 @@ T = TypeVar("T")
 
 
 class MongoDocumentSchemator:
-    def __init__(self, fieldnames: set[str]):
-        if not isinstance(fieldnames, set):
+    # unique by definition, thus never an enum
+    _non_enum_fieldnames = {"_id"}
+
+    def __init__(self, fieldnames: set[str] = None):
+        """
+        Args:
+            fieldnames: fields to profile; if None, every field seen
+        """
+        if fieldnames is not None and not isinstance(fieldnames, set):
             fieldnames = set(fieldnames)
         self._fieldnames = fieldnames
-        self._required = fieldnames.copy()
         self._fields = defaultdict(MongoFieldSchemator)
+        # number of records, and of records with a non-null value by field
+        self._count = 0
+        self._nonnull_counts = defaultdict(int)
 
     @classmethod
     def from_initial_records(cls: Type[T], records: Iterable[dict]) -> T:
@@ -102,31 +163,88 @@ class MongoDocumentSchemator:
         return cls(fieldnames)
 
     @classmethod
-    def from_collection(cls: Type[T], coll: Collection) -> T:
-        skmtr = MongoDocumentSchemator.from_initial_records(coll.find())
-        skmtr.add_many(coll.find())
+    def from_collection(
+        cls: Type[T], coll: Collection, sample_size: int = None, filtr: dict = None
+    ) -> T:
+        """Infer in one pass over the collection, or over a `$sample`"""
+        pipeline = [{"$match": filtr or {}}]
+        if sample_size:
+            pipeline.append({"$sample": {"size": sample_size}})
+        skmtr = cls()
+        skmtr.add_many(coll.aggregate(pipeline))
+        return skmtr
+
+    @classmethod
+    def from_id_ranges(
+        cls: Type[T],
+        coll: Collection,
+        parts: int = 8,
+        sample_size: int = None,
+        workers: int = 8,
+    ) -> T:
+        """Profile _id ranges in parallel, optionally sampling each range,
+        and merge the results"""
+        from joker.mongodb.tools.copying import split_id_ranges
+
+        def profile(bounds):
+            lower, upper = bounds
+            cond = {}
+            if lower is not None:
+                cond["$gte"] = lower
+            if upper is not None:
+                cond["$lt"] = upper
+            size = sample_size // parts + 1 if sample_size else None
+            return cls.from_collection(coll, size, {"_id": cond} if cond else None)
+
+        skmtr = cls()
+        ranges = split_id_ranges(coll, {}, parts)
+        with ThreadPoolExecutor(workers) as executor:
+            for part in executor.map(profile, ranges):
+                skmtr.merge(part)
         return skmtr
 
     @property
     def fieldnames(self) -> set:
+        if self._fieldnames is None:
+            return set(self._fields)
         return self._fieldnames.copy()
 
     def add(self, record: dict):
-        for key in self._fieldnames:
+        self._count += 1
+        keys = record.keys() if self._fieldnames is None else self._fieldnames
+        for key in keys:
             val = record.get(key)
             self._fields[key].add(val)
-            if val is None and val in self._required:
-                self._required.remove(key)
+            if key in self._non_enum_fieldnames:
+                self._fields[key]._disable_enum()
+            if val is not None:
+                self._nonnull_counts[key] += 1
 
     def add_many(self, records: Iterable[dict]):
         for rec in records:
             self.add(rec)
 
+    def merge(self, other: MongoDocumentSchemator):
+        """Combine with a schemator built from other records"""
+        if other._fieldnames is not None:
+            if self._fieldnames is None:
+                self._fieldnames = set()
+            self._fieldnames.update(other._fieldnames)
+        self._count += other._count
+        for key, field in other._fields.items():
+            self._fields[key].merge(field)
+        for key, n in other._nonnull_counts.items():
+            self._nonnull_counts[key] += n
+
     def get_properties(self) -> dict[str, dict]:
         return {k: v.to_jsonschema_property() for k, v in self._fields.items()}
 
     def get_required(self) -> list[str]:
-        return list(sorted(self._required))
+        required = []
+        for key in self.fieldnames:
+            if self._nonnull_counts.get(key, 0) == self._count:
+                required.append(key)
+        return list(sorted(required))
 
     def to_jsonschema(self) -> dict:
         return {
@@ -138,4 +256,133 @@ class MongoDocumentSchemator:
         }
 
 
-__all__ = ["MongoFieldSchemator", "MongoDocumentSchemator"]
+class MongoSchemaProfiler:
+    """Infer a MongoDocumentSchemator with aggregation, on the server side
+
+    Only field names, BSON type counts and a few distinct values per field
+    travel over the wire. Values are grouped on the server only for
+    low-cardinality types (see MongoFieldSchemator._enum_bsontypes)
+    and never for _id; string fields of many distinct values still make
+    large, disk-spilled groups.
+
+    Every embedded-document or array field, at every level down to
+    `max_depth`, costs one more aggregation over the collection; with
+    `sample_size`, each aggregation draws its own sample.
+    Requires MongoDB 5.2+ (for `$firstN`).
+    """
+
+    _non_enum_fieldnames = MongoDocumentSchemator._non_enum_fieldnames
+
+    def __init__(
+        self,
+        coll: Collection,
+        sample_size: int = None,
+        filtr: dict = None,
+        max_depth: int = 3,
+    ):
+        self.coll = coll
+        self.sample_size = sample_size
+        self.filtr = filtr
+        self.max_depth = max_depth
+
+    def _get_base_stages(self) -> list[dict]:
+        stages = [{"$match": self.filtr or {}}]
+        if self.sample_size:
+            stages.append({"$sample": {"size": self.sample_size}})
+        return stages
+
+    def get_pipeline(self, stages: list[dict] = ()) -> list[dict]:
+        """
+        Args:
+            stages: extra stages turning each document into the
+                documents to profile, e.g. an embedded document
+        """
+        bsontype = {"$type": "$_kv.v"}
+        enumerable = {
+            "$and": [
+                {"$in": [bsontype, sorted(MongoFieldSchemator._enum_bsontypes)]},
+                {"$not": [{"$in": ["$_kv.k", sorted(self._non_enum_fieldnames)]}]},
+            ]
+        }
+        max_values = MongoFieldSchemator._max_enum_length + 1
+        field_stages = [
+            {"$project": {"_id": False, "_kv": {"$objectToArray": "$$ROOT"}}},
+            {"$unwind": "$_kv"},
+            # one group per (field, type, value) for enumerable values,
+            # otherwise one group per (field, type)
+            {
+                "$group": {
+                    "_id": {
+                        "k": "$_kv.k",
+                        "t": bsontype,
+                        "v": {"$cond": [enumerable, "$_kv.v", None]},
+                    },
+                    "count": {"$sum": 1},
+                }
+            },
+            {
+                "$group": {
+                    "_id": {"k": "$_id.k", "t": "$_id.t"},
+                    "count": {"$sum": "$count"},
+                    "distinct": {"$sum": 1},
+                    "values": {"$firstN": {"input": "$_id.v", "n": max_values}},
+                }
+            },
+        ]
+        facet = {"total": [{"$count": "n"}], "fields": field_stages}
+        return [*self._get_base_stages(), *stages, {"$facet": facet}]
+
+    @staticmethod
+    def _get_object_stages(key: str) -> list[dict]:
+        return [
+            {"$match": {key: {"$type": "object"}}},
+            {"$replaceRoot": {"newRoot": f"${key}"}},
+        ]
+
+    @staticmethod
+    def _get_items_stages(key: str) -> list[dict]:
+        # profile each item as the only field of a document {"_v": item}
+        return [
+            {"$match": {key: {"$type": "array"}}},
+            {"$unwind": f"${key}"},
+            {"$replaceRoot": {"newRoot": {"_v": f"${key}"}}},
+        ]
+
+    def _profile(self, stages: list[dict], depth: int) -> MongoDocumentSchemator:
+        pipeline = self.get_pipeline(stages)
+        result = next(self.coll.aggregate(pipeline, allowDiskUse=True))
+        skmtr = MongoDocumentSchemator()
+        if result["total"]:
+            skmtr._count = result["total"][0]["n"]
+        for row in result["fields"]:
+            key = row["_id"]["k"]
+            bsontype = row["_id"]["t"]
+            field = skmtr._fields[key]
+            field._bsontypes.add(bsontype)
+            if bsontype != "null":
+                skmtr._nonnull_counts[key] += row["count"]
+            if bsontype not in field._enum_bsontypes:
+                field._disable_enum()
+            elif key in self._non_enum_fieldnames:
+                field._disable_enum()
+            elif row["distinct"] > field._max_enum_length:
+                field._disable_enum()
+            elif field._enum_enabled:
+                field._enum_values.update(row["values"])
+            # keys like "a.b" or "$a" cannot be used as field paths
+            if depth >= self.max_depth or "." in key or key.startswith("$"):
+                continue
+            if bsontype == "object":
+                sub_stages = [*stages, *self._get_object_stages(key)]
+                field._object = self._profile(sub_stages, depth + 1)
+            elif bsontype == "array":
+                sub_stages = [*stages, *self._get_items_stages(key)]
+                items = self._profile(sub_stages, depth + 1)
+                field._items = items._fields.get("_v")
+        return skmtr
+
+    def profile(self) -> MongoDocumentSchemator:
+        return self._profile([], 0)
+
+
+__all__ = ["MongoFieldSchemator", "MongoDocumentSchemator", "MongoSchemaProfiler"]
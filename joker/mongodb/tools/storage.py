@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import dataclasses
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from joker.cast.numeric import human_filesize
+from joker.textmanip.tabular import tabular_format
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class CollectionStorage:
+    host: str
+    ns: str
+    count: int = 0
+    size: int = 0
+    storage_size: int = 0
+    total_index_size: int = 0
+    index_sizes: dict[str, int] = dataclasses.field(default_factory=dict)
+
+    def add_stats(self, stats: dict):
+        # sharded collections report one storageStats per shard
+        self.count += stats.get("count", 0)
+        self.size += stats.get("size", 0)
+        self.storage_size += stats.get("storageSize", 0)
+        self.total_index_size += stats.get("totalIndexSize", 0)
+        for name, size in (stats.get("indexSizes") or {}).items():
+            self.index_sizes[name] = self.index_sizes.get(name, 0) + size
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+def inspect_collection_storage(db: Database, coll_name: str, host: str = None):
+    result = CollectionStorage(host=host, ns=f"{db.name}.{coll_name}")
+    try:
+        pipeline = [{"$collStats": {"storageStats": {}}}]
+        for doc in db[coll_name].aggregate(pipeline):
+            result.add_stats(doc["storageStats"])
+    except OperationFailure:
+        # e.g. servers before 3.4
+        result.add_stats(db.command("collStats", coll_name))
+    return result
+
+
+class StorageInspector:
+    """Inspect storage sizes of many collections concurrently
+
+    Storage stats, and the database and collection names of each host,
+    are cached for `ttl` seconds.
+    """
+
+    _excluded_db_names = {"local", "config"}
+
+    def __init__(self, clients: dict[str, MongoClient], ttl: float = 300, workers=16):
+        self.clients = clients
+        self.ttl = ttl
+        self.workers = workers
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_mongoi(cls, mongoi, **kwargs):
+        """Inspect every host of a MongoInterface"""
+        clients = {host: mongoi.get_mongo(host) for host in mongoi.hosts}
+        return cls(clients, **kwargs)
+
+    def _get_cached(self, key: tuple, func, *args):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        result = func(*args)
+        with self._lock:
+            self._cache[key] = now + self.ttl, result
+        return result
+
+    def _list_db_names(self, host: str) -> list[tuple[str, str]]:
+        client = self.clients[host]
+        names = self._get_cached(("dbs", host), client.list_database_names)
+        return [(host, n) for n in names if n not in self._excluded_db_names]
+
+    def _list_coll_names(self, host: str, db_name: str) -> list[tuple[str, str, str]]:
+        db = self.clients[host].get_database(db_name)
+        names = self._get_cached(
+            ("colls", host, db_name),
+            lambda: db.list_collection_names(filter={"type": "collection"}),
+        )
+        return [(host, db_name, n) for n in names]
+
+    def _inspect(self, host: str, db_name: str, coll_name: str) -> CollectionStorage:
+        db = self.clients[host].get_database(db_name)
+        key = "stats", host, f"{db_name}.{coll_name}"
+        return self._get_cached(key, inspect_collection_storage, db, coll_name, host)
+
+    def inspect(self, hosts: list[str] = None, db_names: list[str] = None) -> list:
+        """Returns a list of CollectionStorage, largest first"""
+        if hosts is None:
+            hosts = list(self.clients)
+        with ThreadPoolExecutor(self.workers) as executor:
+            if db_names is None:
+                pairs = []
+                for sub in executor.map(self._list_db_names, hosts):
+                    pairs.extend(sub)
+            else:
+                pairs = [(h, n) for h in hosts for n in db_names]
+            triples = []
+            for sub in executor.map(lambda p: self._list_coll_names(*p), pairs):
+                triples.extend(sub)
+            results = list(executor.map(lambda t: self._inspect(*t), triples))
+        results.sort(key=lambda r: r.storage_size + r.total_index_size, reverse=True)
+        return results
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+    def print_sizes(self, hosts: list[str] = None, db_names: list[str] = None):
+        rows = []
+        for r in self.inspect(hosts, db_names):
+            num, unit = human_filesize(r.storage_size)
+            inum, iunit = human_filesize(r.total_index_size)
+            rows.append([round(num), unit, round(inum), iunit, r.count, r.host, r.ns])
+        for row in tabular_format(rows):
+            print(*row)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from bson import CodecOptions
+
+from joker.mongodb.tools.pagination import CachedCounter, ExactCounter, QueryParams
+
+asynchronous = pytest.importorskip("joker.mongodb.asynchronous")
+
+
+class _Collection:
+    full_name = "db.coll"
+    codec_options = CodecOptions()
+
+    def __init__(self):
+        self.chunks = []
+
+    async def insert_many(self, docs, ordered=True, session=None):
+        docs = list(docs)
+        self.chunks.append(docs)
+        return SimpleNamespace(inserted_ids=[None] * len(docs))
+
+    async def aggregate(self, pipeline):
+        self.pipeline = pipeline
+
+        async def to_list():
+            return [{"documents": [{"_id": 1}]}]
+
+        return SimpleNamespace(to_list=to_list)
+
+    async def count_documents(self, filtr):
+        self.counted = getattr(self, "counted", 0) + 1
+        return 42
+
+
+async def _agen(records):
+    for rec in records:
+        await asyncio.sleep(0)
+        yield rec
+
+
+async def _collect(aiterator) -> list:
+    return [item async for item in aiterator]
+
+
+def test_aiter_chunks():
+    records = [{"i": i} for i in range(7)]
+    expected = [records[:3], records[3:6], records[6:]]
+    chunks = asyncio.run(_collect(asynchronous._aiter_chunks(records, 3)))
+    assert chunks == expected
+    chunks = asyncio.run(_collect(asynchronous._aiter_chunks(_agen(records), 3)))
+    assert chunks == expected
+    # a byte limit splits chunks further
+    records = [{"s": "x" * 100} for _ in range(4)]
+    aiterator = asynchronous._aiter_chunks(_agen(records), 3, 250)
+    assert [len(c) for c in asyncio.run(_collect(aiterator))] == [2, 1, 1]
+
+
+def test_stream_insert():
+    coll = _Collection()
+    seen = []
+
+    async def callback(progress):
+        seen.append(progress.inserted)
+
+    records = _agen({"i": i} for i in range(5))
+    coro = asynchronous.stream_insert(coll, records, 2, callback=callback)
+    progress = asyncio.run(coro)
+    assert progress.inserted == 5
+    assert progress.chunks == 3
+    assert seen == [2, 4, 5]
+    # records are passed through as raw BSON
+    assert [doc["i"] for chunk in coll.chunks for doc in chunk] == list(range(5))
+
+
+def test_paginate_with_counter():
+    coll = _Collection()
+    counter = CachedCounter(ExactCounter())
+    params = QueryParams()
+    for _ in range(2):
+        result = asyncio.run(asynchronous.paginate(coll, {}, params, counter))
+        assert result.total == 42
+        assert result.items == [{"_id": 1}]
+    assert coll.counted == 1
+    assert "counts" not in coll.pipeline[-1]["$facet"]
+
+
+if __name__ == "__main__":
+    test_aiter_chunks()
+    test_stream_insert()
+    test_paginate_with_counter()
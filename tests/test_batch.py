@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from bson.raw_bson import RawBSONDocument
+
+from joker.mongodb.batch import encode_documents, iter_chunks
+
+
+def test_iter_chunks():
+    records = ({"i": i} for i in range(25))
+    chunks = list(iter_chunks(records, 10))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    records = [{"s": "x" * 100} for _ in range(10)]
+    chunks = list(iter_chunks(records, 100, max_bytes=300))
+    assert all(len(c) == 2 for c in chunks)
+    assert sum(len(c) for c in chunks) == 10
+    raw_chunks = list(iter_chunks(encode_documents(records), 100, max_bytes=300))
+    assert [len(c) for c in raw_chunks] == [len(c) for c in chunks]
+
+
+def test_encode_documents():
+    records = [{"i": 1}, {"_id": 2}]
+    docs = list(encode_documents(records))
+    assert all(isinstance(d, RawBSONDocument) for d in docs)
+    # _id is added to the records, as insert_many would do
+    assert docs[0]["_id"] == records[0]["_id"]
+    assert docs[1]["_id"] == 2
+    assert list(encode_documents(docs)) == docs
+
+
+if __name__ == "__main__":
+    test_iter_chunks()
+    test_encode_documents()
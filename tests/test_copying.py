@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from joker.mongodb.tools.copying import CollectionCopier
+
+
+class _Collection:
+    def __init__(self, full_name: str, docs: list[dict] = None):
+        self.full_name = full_name
+        self.docs = docs or []
+
+    def find(self, filtr: dict, sort=None, batch_size=None):
+        cond = filtr["$and"][1]["_id"] if "$and" in filtr else {}
+        lower = cond.get("$gt", -1)
+        return [d for d in self.docs if d["_id"] > lower]
+
+    def insert_many(self, records: list, ordered=True):
+        self.docs.extend(records)
+        return type("_Result", (), {"inserted_ids": [r["_id"] for r in records]})
+
+
+class _Store(dict):
+    def load(self, key: str):
+        return self.get(key)
+
+    def save(self, key: str, value):
+        self[key] = value
+
+
+def test_copier_checkpoints():
+    source = _Collection("db.a", [{"_id": i} for i in range(5)])
+    store = _Store()
+    # an interrupted copy, up to _id 2
+    store["copy:db.a:db.b:ranges"] = [[None, None]]
+    store["copy:db.a:db.b:0"] = 2
+    target = _Collection("db.b")
+    copier = CollectionCopier(source, target, workers=1, checkpoint_store=store)  # noqa
+    assert copier.run().inserted == 2
+    assert not any(store.values())
+    # a finished copy leaves nothing to resume from
+    target = _Collection("db.b")
+    copier = CollectionCopier(source, target, workers=1, checkpoint_store=store)  # noqa
+    assert copier.run().inserted == 5
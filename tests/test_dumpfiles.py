@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import gzip
+import io
+from types import SimpleNamespace
+
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+from joker.mongodb.tools.dumpfiles import (
+    DumpDirectory,
+    _create_collection,
+    iter_raw_documents,
+    write_documents,
+)
+
+
+def test_bson_frames():
+    docs = [{"_id": ObjectId(), "i": i, "s": "x" * i} for i in range(10)]
+    buf = io.BytesIO()
+    assert write_documents(buf, docs) == 10
+    buf.seek(0)
+    loaded = list(iter_raw_documents(buf))
+    assert all(isinstance(d, RawBSONDocument) for d in loaded)
+    assert [dict(d) for d in loaded] == docs
+    buf = io.BytesIO()
+    write_documents(buf, loaded)
+    buf.seek(0)
+    assert [dict(d) for d in iter_raw_documents(buf)] == docs
+
+
+class _Database:
+    def __init__(self):
+        self.created = {}
+
+    def list_collection_names(self, filter: dict):
+        return [n for n in self.created if n == filter["name"]]
+
+    def create_collection(self, name: str, **options):
+        self.created[name] = options
+
+
+class _Collection:
+    def __init__(self, name: str, database: _Database):
+        self.name = name
+        self.database = database
+        self.full_name = f"db.{name}"
+        self.docs = []
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(dict(d) for d in docs)
+        return SimpleNamespace(inserted_ids=[d["_id"] for d in docs])
+
+
+def test_create_collection():
+    db = _Database()
+    options = {"capped": True, "size": 4096}
+    _create_collection(_Collection("a", db), options)
+    _create_collection(_Collection("a", db), {"capped": False})
+    _create_collection(_Collection("b", db), {})
+    assert db.created == {"a": options}
+
+
+class _Client:
+    def __init__(self):
+        self.colls = {}
+
+    def get_database(self, db_name: str):
+        return SimpleNamespace(get_collection=self.get_collection)
+
+    def get_collection(self, coll_name: str):
+        return self.colls.setdefault(coll_name, _Collection(coll_name, _Database()))
+
+
+def test_restore_mixed_suffixes(tmp_path):
+    (tmp_path / "db").mkdir()
+    docs = [{"_id": i} for i in range(3)]
+    with open(tmp_path / "db" / "a.bson", "wb") as fout:
+        write_documents(fout, docs)
+    with gzip.open(tmp_path / "db" / "b.bson.gz", "wb") as fout:
+        write_documents(fout, docs[:1])
+    for gzip_ in (True, False):
+        dumpdir = DumpDirectory(tmp_path, gzip_=gzip_)
+        assert dumpdir.list_namespaces() == [("db", "a"), ("db", "b")]
+        client = _Client()
+        results = dumpdir.restore(client)
+        assert results["db.a"] == {"inserted": 3, "duplicates": 0}
+        assert results["db.b"] == {"inserted": 1, "duplicates": 0}
+        assert client.colls["a"].docs == docs
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    test_bson_frames()
+    test_restore_mixed_suffixes(Path(tempfile.mkdtemp()))
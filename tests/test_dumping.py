@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import pytest
+from bson import Timestamp
+
+from joker.mongodb.tools.dumping import IncrementalDumper
+
+
+class _Collection:
+    def __init__(self, docs: list[dict], full_name="db.coll"):
+        self.docs = docs
+        self.full_name = full_name
+
+    @staticmethod
+    def _match(doc: dict, filtr: dict) -> bool:
+        for key, cond in filtr.items():
+            val = doc.get(key)
+            if "$in" in cond and val not in cond["$in"]:
+                return False
+            if "$gt" in cond and not (val is not None and val > cond["$gt"]):
+                return False
+            if "$lte" in cond and not (val is not None and val <= cond["$lte"]):
+                return False
+            if "$exists" in cond and val is None:
+                return False
+        return True
+
+    def find(self, filtr: dict, projection=None):
+        return [d for d in self.docs if self._match(d, filtr)]
+
+    def find_one(self, filtr: dict, projection=None, sort=None):
+        docs = self.find(filtr)
+        if not docs:
+            return
+        key, direction = sort[0]
+        return sorted(docs, key=lambda d: d[key], reverse=direction < 0)[0]
+
+
+class _Oplog(_Collection):
+    def find(self, filtr: dict, projection=None):
+        ts = filtr.get("ts", {})
+        return super().find({"ts": ts} if ts else {})
+
+    def find_one(self, filtr: dict, projection=None, sort=None):
+        entries = sorted(self.docs, key=lambda e: e["ts"])
+        return entries[0] if sort[0][1] > 0 else entries[-1]
+
+
+class _Client:
+    def __init__(self, oplog: _Oplog):
+        self.oplog = oplog
+
+    def get_database(self, name: str):
+        return self
+
+    def get_collection(self, name: str):
+        return self.oplog
+
+
+class _Database:
+    def __init__(self, client: _Client):
+        self.client = client
+
+
+def test_full_dump_by_field(tmp_path):
+    docs = [{"_id": 1}, {"_id": 2, "updated_at": 5}]
+    dumper = IncrementalDumper(tmp_path, field="updated_at")
+    hi, found, _ = dumper._get_delta_by_field(_Collection(docs), None)
+    assert hi == 5
+    assert list(found) == docs
+    hi, found, _ = dumper._get_delta_by_field(_Collection(docs), 5)
+    assert list(found) == []
+
+
+def test_delta_by_oplog():
+    coll = _Collection([{"_id": 1}, {"_id": 2}])
+    txn = {
+        "ts": Timestamp(3, 0),
+        "ns": "admin.$cmd",
+        "o": {"applyOps": [
+            {"ns": "db.coll", "o": {"_id": 2}},
+            {"ns": "db.other", "o": {"_id": 9}},
+        ]},
+    }
+    oplog = _Oplog([
+        {"ts": Timestamp(1, 0), "ns": "db.coll", "o": {"_id": 0}},
+        {"ts": Timestamp(2, 0), "ns": "db.coll", "o": {"_id": 3}},
+        txn,
+    ])
+    coll.database = _Database(_Client(oplog))
+    dumper = IncrementalDumper("unused", field=None)
+    hi, docs, deleted = dumper._get_delta_by_oplog(coll, Timestamp(1, 0))
+    assert hi == Timestamp(3, 0)
+    assert list(docs) == [{"_id": 2}]
+    assert deleted == [{"_id": 3}]
+    with pytest.raises(RuntimeError):
+        dumper._get_delta_by_oplog(coll, Timestamp(0, 5))
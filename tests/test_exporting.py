@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import datetime
+import gzip
+import lzma
+
+import pytest
+from bson import ObjectId
+
+from joker.mongodb.tools.exporting import (
+    export_csv,
+    export_jsonl,
+    export_parquet,
+    flatten,
+)
+
+
+def test_flatten():
+    doc = {"a": {"b": 1, "c": {"d": 2}}, "e": [3], "f": {}}
+    assert flatten(doc) == {"a.b": 1, "a.c.d": 2, "e": [3], "f": {}}
+
+
+def test_export(tmp_path):
+    records = ({"_id": ObjectId(), "a": {"b": i}} for i in range(5))
+    path = tmp_path / "out.csv.gz"
+    assert export_csv(records, path, sample_size=2) == 5
+    with gzip.open(path, "rt") as fin:
+        lines = fin.read().splitlines()
+    assert lines[0] == "_id,a.b"
+    assert len(lines) == 6
+    path = tmp_path / "out.jsonl"
+    assert export_jsonl([{"x": 1}], path) == 1
+    assert path.read_text() == '{"x": 1}\n'
+    path = tmp_path / "out.jsonl.xz"
+    assert export_jsonl([{"x": 1}], path) == 1
+    assert lzma.decompress(path.read_bytes()) == b'{"x": 1}\n'
+
+
+def test_export_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    now = datetime.datetime(2024, 1, 1)
+    records = [{"_id": ObjectId(), "t": now, "x": None} for _ in range(3)]
+    records.append({"_id": ObjectId(), "t": now, "x": 1})
+    # beyond the sample: a value of another type
+    records.append({"_id": ObjectId(), "t": now, "x": "a"})
+    path = tmp_path / "out.parquet"
+    assert export_parquet(records, path, sample_size=4, batch_size=2) == 5
+    table = pq.read_table(path)
+    assert str(table.schema.field("t").type) == "timestamp[ms]"
+    assert str(table.schema.field("x").type) == "int64"
+    assert table.column("x").to_pylist() == [None, None, None, 1, None]
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    test_flatten()
+    test_export(Path(tempfile.mkdtemp()))
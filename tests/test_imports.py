@@ -4,6 +4,7 @@
 import importlib
 
 import joker.meta
+import pymongo
 from volkanic.introspect import find_all_plain_modules
 
 dotpath_prefixes = [
@@ -16,6 +17,12 @@ class _GI(joker.meta.JokerInterface):
     package_name = "joker.mongodb"
 
 
+# modules depending on a newer pymongo than requirements.txt
+min_pymongo_versions = {
+    "joker.mongodb.asynchronous": (4, 9),
+}
+
+
 def _check_prefix(path):
     for prefix in dotpath_prefixes:
         if path.startswith(prefix):
@@ -23,10 +30,15 @@ def _check_prefix(path):
     return False
 
 
+def _check_pymongo_version(path):
+    min_version = min_pymongo_versions.get(path, ())
+    return pymongo.version_tuple[: len(min_version)] >= min_version
+
+
 def test_module_imports():
     pdir = _GI.under_project_dir()
     for dotpath in find_all_plain_modules(pdir):
-        if _check_prefix(dotpath):
+        if _check_prefix(dotpath) and _check_pymongo_version(dotpath):
             print("importing", dotpath)
             importlib.import_module(dotpath)
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import threading
+import time
+
+from pymongo.errors import DuplicateKeyError
+
+from joker.mongodb.tools.integrity import LeaseLock, SerialNumberAllocator
+
+
+class _Collection:
+    def __init__(self):
+        self.i = 0
+        self.calls = 0
+
+    def find_one_and_update(self, filtr: dict, update: dict, **kwargs):
+        self.calls += 1
+        self.i += update["$inc"]["i"]
+        return {"_id": filtr["_id"], "i": self.i}
+
+
+class _Allocator(SerialNumberAllocator):
+    coll_ = _Collection()
+
+    @staticmethod
+    def _get_collection():
+        return _Allocator.coll_
+
+
+def test_serial_number_allocator():
+    allocator = _Allocator(block_size=10)
+    numbers = []
+
+    def target():
+        for _ in range(50):
+            numbers.append(allocator.next_number())
+
+    threads = [threading.Thread(target=target) for _ in range(4)]
+    for thr in threads:
+        thr.start()
+    for thr in threads:
+        thr.join()
+    assert sorted(numbers) == list(range(1, 201))
+    assert _Allocator.coll_.calls <= 21
+    assert next(allocator) == "ID000201"
+
+
+class _Result:
+    def __init__(self, n: int):
+        self.matched_count = self.deleted_count = n
+
+
+class _LockCollection:
+    def __init__(self):
+        self.docs = {}
+        self.extended = 0
+
+    def _match(self, doc: dict, filtr: dict) -> bool:
+        if "owner" in filtr and doc["owner"] != filtr["owner"]:
+            return False
+        for cond in filtr.get("$or", []):
+            if cond.get("owner") == doc["owner"]:
+                return True
+            if "expire_at" in cond and doc["expire_at"] < cond["expire_at"]["$lt"]:
+                return True
+        return "$or" not in filtr
+
+    def update_one(self, filtr: dict, update: dict, upsert=False):
+        doc = self.docs.get(filtr["_id"])
+        if doc is None:
+            if not upsert:
+                return _Result(0)
+            self.docs[filtr["_id"]] = dict(update["$set"])
+            return _Result(0)
+        if not self._match(doc, filtr):
+            if upsert:
+                raise DuplicateKeyError("duplicate _id")
+            return _Result(0)
+        if not upsert:
+            self.extended += 1
+        doc.update(update["$set"])
+        return _Result(1)
+
+    def delete_one(self, filtr: dict):
+        doc = self.docs.get(filtr["_id"])
+        if doc is None or not self._match(doc, filtr):
+            return _Result(0)
+        del self.docs[filtr["_id"]]
+        return _Result(1)
+
+
+class _LeaseLock(LeaseLock):
+    coll_ = _LockCollection()
+
+    @staticmethod
+    def _get_collection():
+        return _LeaseLock.coll_
+
+
+def test_lease_lock():
+    lock = _LeaseLock("job", ttl=0.3, renew=True)
+    other = _LeaseLock("job", ttl=0.3)
+    assert lock.acquire(timeout=0.1)
+    assert not other.acquire(timeout=0.1)
+    assert not other.release()
+    # re-acquired right after release: the lease is still renewed
+    assert lock.release()
+    assert lock.acquire(blocking=False)
+    time.sleep(0.5)
+    assert _LeaseLock.coll_.extended >= 1
+    assert not other.try_acquire()
+    lock.release()
+    with other:
+        assert not lock.try_acquire()
+
+
+class _UnreachableLock(_LeaseLock):
+    def extend(self) -> bool:
+        raise ConnectionError("network partition")
+
+
+def test_lease_lock_lost_when_unrenewable():
+    _LeaseLock.coll_.docs.clear()
+    lock = _UnreachableLock("partitioned", ttl=0.15, renew=True)
+    assert lock.acquire(blocking=False)
+    assert lock.lost.wait(1)
+    lock.release()
+
+
+if __name__ == "__main__":
+    test_serial_number_allocator()
+    test_lease_lock()
+    test_lease_lock_lost_when_unrenewable()
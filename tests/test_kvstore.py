@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import time
+
+from joker.mongodb.tools.kvstore import MISSING, CachedKVStore
+
+
+class _Collection:
+    def __init__(self, data: dict):
+        self.data = data
+        self.calls = 0
+
+    def find_one(self, filtr: dict, projection=None):
+        self.calls += 1
+        key = filtr["_id"]
+        if key in self.data:
+            return {"value": self.data[key]}
+
+    def find(self, filtr: dict, projection=None):
+        self.calls += 1
+        for key in filtr["_id"]["$in"]:
+            if key in self.data:
+                yield {"_id": key, "value": self.data[key]}
+
+
+def test_cached_kvstore():
+    coll = _Collection({"a": 1})
+    kvs = CachedKVStore(coll)  # noqa
+    assert kvs.load("a") == 1
+    assert kvs.load("a") == 1
+    assert kvs.load("b") is None
+    assert kvs.load("b") is None
+    assert coll.calls == 2
+    assert kvs.get_stats() == {"hits": 2, "misses": 2, "size": 2}
+    kvs.invalidate("a")
+    kvs.load("a")
+    assert coll.calls == 3
+
+
+def test_invalidation_during_read():
+    coll = _Collection({"a": 1})
+    kvs = CachedKVStore(coll)  # noqa
+    find_one = coll.find_one
+
+    def find_one_then_change(*args, **kwargs):
+        record = find_one(*args, **kwargs)
+        # a change event arrives while the stale value is in flight
+        coll.data["a"] = 2
+        kvs.invalidate("a")
+        return record
+
+    coll.find_one = find_one_then_change
+    assert kvs.load("a") == 1
+    coll.find_one = find_one
+    assert kvs.load("a") == 2
+
+
+def test_load_many():
+    coll = _Collection({"a": 1, "b": 2})
+    kvs = CachedKVStore(coll)  # noqa
+    kvs.load("a")
+    values = kvs.load_many(["a", "b", "c"])
+    assert values == {"a": 1, "b": 2, "c": MISSING}
+    assert coll.calls == 2
+    assert kvs.load_many(["b", "c"], missing=None) == {"b": 2, "c": None}
+    assert coll.calls == 2
+
+
+class _ChangeStream:
+    """Yields its events, then dies like a stream after an invalidate event"""
+
+    def __init__(self, events: list):
+        self.events = list(events)
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.alive = False
+
+    def try_next(self):
+        if self.events:
+            event = self.events.pop(0)
+            if event["operationType"] == "invalidate":
+                self.alive = False
+            return event
+        time.sleep(0.01)
+
+
+class _WatchedCollection(_Collection):
+    def __init__(self, data: dict):
+        super().__init__(data)
+        self.streams = []
+
+    def watch(self):
+        events = [{"operationType": "invalidate"}] if not self.streams else []
+        self.streams.append(_ChangeStream(events))
+        return self.streams[-1]
+
+
+def test_watch_reopens_dead_stream():
+    coll = _WatchedCollection({"a": 1})
+    kvs = CachedKVStore(coll)  # noqa
+    kvs.start_watching()
+    deadline = time.monotonic() + 2
+    while len(coll.streams) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    kvs.stop_watching()
+    assert len(coll.streams) == 2
+    kvs.load("a")
+    assert kvs.get_stats()["size"] == 1
+
+
+if __name__ == "__main__":
+    test_cached_kvstore()
+    test_load_many()
+    test_watch_reopens_dead_stream()
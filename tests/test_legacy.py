@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import gzip
+
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.raw_bson import RawBSONDocument
+
+from joker.mongodb.legacy import MongoInterfaceExtended
+from joker.mongodb.tools.dumpfiles import write_documents
+
+
+class _Collection:
+    codec_options = DEFAULT_CODEC_OPTIONS
+
+    def __init__(self):
+        self.docs = []
+
+    def find_one(self, projection=None):
+        return self.docs[0] if self.docs else None
+
+    def insert_many(self, docs: list, ordered=True):
+        self.docs.extend(docs)
+        return type("_Result", (), {"inserted_ids": [d["_id"] for d in docs]})
+
+
+class _MongoInterface(MongoInterfaceExtended):
+    def __init__(self):
+        super().__init__({})
+        self.colls = {}
+
+    def get_coll(self, host: str, db_name: str, coll_name: str):
+        return self.colls.setdefault((host, db_name, coll_name), _Collection())
+
+
+def test_restore_paths(tmp_path):
+    paths = []
+    for name in ["a", "b"]:
+        path = tmp_path / f"h.db.{name}.0.bson.gz"
+        with gzip.open(path, "wb") as fout:
+            write_documents(fout, [{"_id": i, "name": name} for i in range(3)])
+        paths.append(path)
+    mongoi = _MongoInterface()
+    results = mongoi.restore_paths(paths)
+    assert [r["inserted"] for r in results.values()] == [3, 3]
+    docs = mongoi.colls["h", "db", "b"].docs
+    assert all(isinstance(d, RawBSONDocument) for d in docs)
+    assert [dict(d) for d in docs] == [{"_id": i, "name": "b"} for i in range(3)]
+    # not empty any more: skipped
+    assert mongoi.restore_a_path(paths[0]) is None
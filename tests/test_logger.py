@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+from joker.mongodb.logger import MongoCommandMetrics
+
+
+def _event(request_id: int, duration_micros: int = 0):
+    return SimpleNamespace(
+        request_id=request_id,
+        connection_id=("localhost", 27017),
+        database_name="db",
+        command_name="find",
+        command={"find": "coll", "filter": {}},
+        duration_micros=duration_micros,
+        reply={"ok": 1},
+    )
+
+
+def test_command_metrics():
+    metrics = MongoCommandMetrics()
+    for i in range(100):
+        metrics.started(_event(i))
+        metrics.succeeded(_event(i, 1000 * (i + 1)))
+    metrics.started(_event(100))
+    metrics.failed(_event(100, 1000))
+    (row,) = metrics.snapshot()
+    assert row["collection"] == "coll"
+    assert row["count"] == 101
+    assert row["errors"] == 1
+    assert 25 <= row["p50"] <= 100
+    text = metrics.to_prometheus()
+    assert 'le="+Inf"} 101' in text
+    # disabled while a command is in flight
+    metrics.started(_event(101))
+    metrics.enabled = False
+    metrics.succeeded(_event(101, 1000))
+    metrics.started(_event(102))
+    assert metrics.snapshot()[0]["count"] == 101
+    assert not metrics._pending
+
+
+if __name__ == "__main__":
+    test_command_metrics()
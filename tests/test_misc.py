@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+from pymongo import ReplaceOne, UpdateOne
+
+from joker.mongodb.tools.misc import CollectionWrapper
+
+
+class _Collection:
+    def __init__(self, docs: list[dict] = ()):
+        self.docs = list(docs)
+        self.bulks = []
+        self.queries = []
+
+    @staticmethod
+    def _match(doc: dict, filtr: dict) -> bool:
+        if "$or" in filtr:
+            return any(_Collection._match(doc, f) for f in filtr["$or"])
+        for key, cond in filtr.items():
+            if isinstance(cond, dict):
+                if doc.get(key) not in cond["$in"]:
+                    return False
+            elif doc.get(key) != cond:
+                return False
+        return True
+
+    def find(self, filtr: dict, projection: dict):
+        self.queries.append((filtr, projection))
+        for doc in self.docs:
+            if self._match(doc, filtr):
+                yield {k: doc[k] for k, v in projection.items() if v}
+
+    def bulk_write(self, ops, ordered=True):
+        self.bulks.append(ops)
+        return SimpleNamespace(
+            upserted_count=1, matched_count=len(ops) - 1, modified_count=1
+        )
+
+
+def test_upsert():
+    coll = _Collection()
+    cw = CollectionWrapper(coll)
+    records = [{"a": i, "b": "x", "v": i * 10} for i in range(5)]
+    counts = cw.upsert(records, uk=["a", "b"], chunk_size=2)
+    assert counts == {"inserted": 3, "matched": 2, "modified": 3}
+    assert [len(ops) for ops in coll.bulks] == [2, 2, 1]
+    filtr = {"a": 0, "b": "x"}
+    assert coll.bulks[0][0] == UpdateOne(filtr, {"$set": records[0]}, upsert=True)
+    op = CollectionWrapper._build_upsert_op(records[0], "a", replace=True)
+    assert op == ReplaceOne({"a": 0}, records[0], upsert=True)
+    # nothing to write
+    counts = cw.upsert_with_index([])
+    assert counts == {"inserted": 0, "matched": 0, "modified": 0}
+    assert len(coll.bulks) == 3
+
+
+def test_find_existing_keys():
+    docs = [{"_id": i, "a": i, "b": "x"} for i in range(0, 10, 2)]
+    coll = _Collection(docs)
+    cw = CollectionWrapper(coll)
+    records = [{"a": i, "b": "x"} for i in range(5)]
+    assert cw.find_existing_keys(records, "a", chunk_size=3) == {0, 2, 4}
+    assert coll.queries == [
+        ({"a": {"$in": [0, 1, 2]}}, {"a": True, "_id": False}),
+        ({"a": {"$in": [3, 4]}}, {"a": True, "_id": False}),
+    ]
+    coll.queries.clear()
+    existing = cw.find_existing_keys(records, ["a", "b"], chunk_size=3)
+    assert existing == {(0, "x"), (2, "x"), (4, "x")}
+    filtr, projection = coll.queries[1]
+    assert filtr == {"$or": [{"a": 3, "b": "x"}, {"a": 4, "b": "x"}]}
+    assert projection == {"a": True, "b": True, "_id": False}
+
+
+if __name__ == "__main__":
+    test_upsert()
+    test_find_existing_keys()
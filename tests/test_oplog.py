@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+import queue
+import threading
+import time
+
+from joker.mongodb.tools.oplog import ChangeStreamRegistry
+
+
+def _event(coll_name: str, id_, seq: int) -> dict:
+    return {"ns": {"coll": coll_name}, "documentKey": {"_id": id_}, "seq": seq}
+
+
+def test_dispatch():
+    registry = ChangeStreamRegistry(None)  # noqa
+    registry._queues = [queue.Queue() for _ in range(4)]
+    events = [_event("c", i % 5, i) for i in range(50)]
+    for event in events:
+        registry._dispatch(event)
+    metrics = registry.get_metrics()
+    assert metrics["dispatched"] == 50
+    assert sum(metrics["queue_depths"]) == 50
+    # events of a document are all in one queue, in order
+    seqs_by_id = {}
+    for idx, q in enumerate(registry._queues):
+        while not q.empty():
+            _, event = q.get()
+            id_ = event["documentKey"]["_id"]
+            seqs = seqs_by_id.setdefault(id_, (idx, []))
+            assert seqs[0] == idx
+            seqs[1].append(event["seq"])
+    for id_, (_, seqs) in seqs_by_id.items():
+        assert seqs == list(range(id_, 50, 5))
+
+
+class _ChangeStream:
+    def __init__(self, events: list, token: str):
+        self.events = events
+        self.resume_token = token
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.alive = False
+
+    def try_next(self):
+        if self.events:
+            return self.events.pop(0)
+        # the stream of an invalidate event closes after it
+        self.alive = self.resume_token is None
+        time.sleep(0.01)
+
+
+class _Database:
+    def __init__(self):
+        self.start_afters = []
+
+    def watch(self, pipeline: list, start_after=None):
+        self.start_afters.append(start_after)
+        if len(self.start_afters) == 1:
+            return _ChangeStream([{"operationType": "invalidate"}], "t1")
+        return _ChangeStream([_event("c", 1, 0)], None)
+
+
+def test_execute_multiplexed_reopens():
+    db = _Database()
+    registry = ChangeStreamRegistry(db)  # noqa
+    handled = []
+    registry.register("c", handled.append)
+    thr = threading.Thread(target=registry.execute_multiplexed, args=(2,))
+    thr.start()
+    deadline = time.monotonic() + 2
+    while not handled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    registry.stop()
+    thr.join()
+    assert db.start_afters == [None, "t1"]
+    assert handled == [_event("c", 1, 0)]
+    assert registry.get_metrics()["processed"] == 2
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from bson import ObjectId
+
+from joker.mongodb.tools.pagination import (
+    CachedCounter,
+    PaginatedResult,
+    QueryParams,
+    decode_keyset_token,
+    encode_keyset_token,
+    TotalCounter,
+)
+
+
+def test_keyset_token():
+    values = [3, "abc", ObjectId()]
+    assert decode_keyset_token(encode_keyset_token(values)) == values
+
+
+def test_keyset_pagination():
+    params = QueryParams(limit=2, sort="rank", order=1)
+    assert params.get_keyset_filter() == {}
+    docs = [{"_id": i, "rank": i // 2} for i in range(3)]
+    result = PaginatedResult.from_keyset(docs, params)
+    assert len(result.items) == 2
+    params.after = result.next_token
+    assert params.get_keyset_filter() == {
+        "$or": [
+            {"rank": {"$gt": 0}},
+            {"rank": {"$eq": 0}, "_id": {"$gt": 1}},
+        ]
+    }
+    result = PaginatedResult.from_keyset(docs[2:], params)
+    assert result.next_token is None
+    assert "next_token" not in result.to_dict()
+    # operators in a crafted token stay literal values
+    params.after = encode_keyset_token([{"$ne": None}, 1])
+    branch = params.get_keyset_filter()["$or"][1]
+    assert branch["rank"] == {"$eq": {"$ne": None}}
+
+
+class _Coll:
+    full_name = "db.coll"
+
+
+class _CallCounter(TotalCounter):
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, coll, filtr: dict) -> int:
+        self.calls += 1
+        return 42
+
+
+def test_cached_counter():
+    inner = _CallCounter()
+    counter = CachedCounter(inner, ttl=60)
+    assert counter.count(_Coll(), {"a": 1}) == 42
+    assert counter.count(_Coll(), {"a": 1}) == 42
+    assert inner.calls == 1
+    counter.count(_Coll(), {"a": 2})
+    assert inner.calls == 2
+    counter.invalidate(_Coll())
+    counter.count(_Coll(), {"a": 1})
+    assert inner.calls == 3
+
+
+if __name__ == "__main__":
+    test_keyset_token()
+    test_keyset_pagination()
+    test_cached_counter()
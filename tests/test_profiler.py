@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from joker.mongodb.profiler import SlowCommandRecord, redact
+
+
+def test_redact():
+    pipeline = [{"$match": {"a": 1, "$or": [{"b": "x"}, {"c": [1, 2]}]}}]
+    assert redact({"pipeline": pipeline}) == {
+        "pipeline": [{"$match": {"a": "?", "$or": [{"b": "?"}, {"c": "?"}]}}]
+    }
+
+
+def test_load_explain():
+    explained = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "SORT",
+                "inputStage": {"stage": "COLLSCAN"},
+            }
+        },
+        "executionStats": {"nReturned": 1, "totalDocsExamined": 1000},
+    }
+    record = SlowCommandRecord("db", "coll", "find", 250.0, {})
+    record.load_explain(explained)
+    assert record.stages == ["SORT", "COLLSCAN"]
+    assert record.collscan and record.in_memory_sort
+    assert record.docs_examined == 1000
+    # aggregate
+    record = SlowCommandRecord("db", "coll", "aggregate", 250.0, {})
+    record.load_explain({"stages": [{"$cursor": explained}, {"$group": {}}]})
+    assert record.stages == ["SORT", "COLLSCAN"]
+    assert record.docs_examined == 1000
+    assert record.n_returned == 1
+
+
+if __name__ == "__main__":
+    test_redact()
+    test_load_explain()
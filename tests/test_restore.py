@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from joker.mongodb.tools.restore import DumpSuite, _download
+
+
+class _Response:
+    def __init__(self, status_code: int, content: bytes = b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size: int):
+        yield self.content
+
+
+class _Session:
+    """Serves `content` under `etag`, honoring Range and If-Range"""
+
+    def __init__(self, content: bytes, etag: str):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url: str, stream=False, headers=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        if "Range" not in headers or headers.get("If-Range") != self.etag:
+            return _Response(200, self.content)
+        offset = int(headers["Range"][6:-1])
+        if offset >= len(self.content):
+            content_range = f"bytes */{len(self.content)}"
+            return _Response(416, headers={"Content-Range": content_range})
+        return _Response(206, self.content[offset:])
+
+
+def test_download_resume(tmp_path):
+    path = tmp_path / "f"
+    part_path = tmp_path / "f.part"
+    part_path.write_bytes(b"abc")
+    (tmp_path / "f.etag").write_text("v1")
+    # resumed under the same ETag
+    _download("http://x/f", path, _Session(b"abcdef", "v1"), "v1")
+    assert path.read_bytes() == b"abcdef"
+    # the remote file changed: downloaded from scratch
+    part_path.write_bytes(b"abc")
+    (tmp_path / "f.etag").write_text("v1")
+    _download("http://x/f", path, _Session(b"xyz", "v2"), "v2")
+    assert path.read_bytes() == b"xyz"
+    # a partial file longer than the remote file
+    part_path.write_bytes(b"abcdef")
+    (tmp_path / "f.etag").write_text("v3")
+    session = _Session(b"abc", "v3")
+    _download("http://x/f", path, session, "v3")
+    assert path.read_bytes() == b"abc"
+    assert len(session.requests) == 2
+    assert not (tmp_path / "f.etag").exists()
+
+
+class _HeadlessSession(_Session):
+    def head(self, url: str, allow_redirects=False):
+        return _Response(405)
+
+
+def test_fetch_without_head(tmp_path):
+    suite = DumpSuite(tmp_path / "dump", "http://x/", tmp_path / "cache")
+    suite._local.session = _HeadlessSession(b"abc", "v1")
+    suite._fetch_file("db/c.bson.gz")
+    assert (tmp_path / "dump" / "db" / "c.bson.gz").read_bytes() == b"abc"
+    assert not suite.cache._index
+    assert not (tmp_path / "cache").exists()
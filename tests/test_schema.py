@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+
+from joker.mongodb.tools.schema import MongoDocumentSchemator, MongoSchemaProfiler
+
+_records = [
+    {"_id": 1, "level": "low", "tags": ["a"], "geo": {"lat": 1.5, "lng": 2.5}},
+    {"_id": 2, "level": "high", "tags": [], "geo": {"lat": 0.5}},
+    {"_id": 3, "level": "mid", "note": None, "size": 2**40},
+]
+
+
+def test_schema_inference():
+    skmtr = MongoDocumentSchemator()
+    skmtr.add_many(_records)
+    schema = skmtr.to_jsonschema()
+    assert schema["required"] == ["_id", "level"]
+    props = schema["properties"]
+    assert props["level"] == {"bsonType": "string", "enum": ["high", "low", "mid"]}
+    assert props["tags"]["items"] == {"bsonType": "string", "enum": ["a"]}
+    assert props["geo"]["required"] == ["lat"]
+    assert props["geo"]["properties"]["lng"]["bsonType"] == "double"
+    assert props["note"]["bsonType"] == "null"
+
+
+def test_schema_merge():
+    whole = MongoDocumentSchemator()
+    whole.add_many(_records)
+    merged = MongoDocumentSchemator()
+    for rec in _records:
+        part = MongoDocumentSchemator()
+        part.add(rec)
+        merged.merge(part)
+    assert merged.to_jsonschema() == whole.to_jsonschema()
+
+
+class _Collection:
+    """Evaluates just enough of the profiling pipeline in Python"""
+
+    _bsontypes = {str: "string", float: "double", dict: "object", list: "array"}
+    _bsontypes.update({type(None): "null", bool: "bool"})
+    _enum_bsontypes = {"string", "int", "bool", "null"}
+
+    def __init__(self, docs: list[dict]):
+        self.docs = docs
+
+    @classmethod
+    def _get_bsontype(cls, val) -> str:
+        # what $type returns for values encoded by pymongo
+        if type(val) is int:
+            return "int" if -(2**31) <= val < 2**31 else "long"
+        return cls._bsontypes[type(val)]
+
+    def _apply(self, docs: list, stage: dict) -> list:
+        if "$match" in stage:
+            if not stage["$match"]:
+                return docs
+            ((key, cond),) = stage["$match"].items()
+            return [d for d in docs if self._get_bsontype(d.get(key)) == cond["$type"]]
+        if "$unwind" in stage:
+            key = stage["$unwind"][1:]
+            return [{**d, key: item} for d in docs for item in d[key]]
+        root = stage["$replaceRoot"]["newRoot"]
+        if isinstance(root, str):
+            return [d[root[1:]] for d in docs]
+        return [{"_v": d[root["_v"][1:]]} for d in docs]
+
+    def aggregate(self, pipeline: list, **kwargs):
+        docs = self.docs
+        for stage in pipeline[:-1]:
+            docs = self._apply(docs, stage)
+        groups = {}
+        for doc in docs:
+            for k, v in doc.items():
+                t = self._get_bsontype(v)
+                group = groups.setdefault((k, t), {"count": 0, "values": []})
+                group["count"] += 1
+                if t not in self._enum_bsontypes or k == "_id":
+                    v = None
+                if v not in group["values"]:
+                    group["values"].append(v)
+        fields = [
+            {
+                "_id": {"k": k, "t": t},
+                "count": g["count"],
+                "distinct": len(g["values"]),
+                "values": g["values"][:8],
+            }
+            for (k, t), g in groups.items()
+        ]
+        yield {"total": [{"n": len(docs)}] if docs else [], "fields": fields}
+
+
+def test_schema_profiler():
+    skmtr = MongoDocumentSchemator()
+    skmtr.add_many(_records)
+    schema = MongoSchemaProfiler(_Collection(_records)).profile().to_jsonschema()
+    assert schema == skmtr.to_jsonschema()
+    assert schema["properties"]["_id"] == {"bsonType": "int"}
+    assert schema["properties"]["size"] == {"bsonType": "long"}